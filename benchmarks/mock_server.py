@@ -0,0 +1,329 @@
+#! /usr/bin/python
+"  A local stand in for the Giant Bomb API, used by the benchmarks  "
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+API_PAGE_SIZE = 100
+VIDEO_TYPES = [(3, "Quick Look"), (5, "Features"), (8, "Endurance Run")]
+QUALITIES = ("hd", "high", "low")
+# Synthetic video content repeats a block of this size
+VIDEO_BLOCK_SIZE = 64 * 1024
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+class MockOptions:
+    " How the mock server behaves, all of it can be changed while it is running "
+    def __init__(self, shows=5, episodes_per_show=200, latency=0.0, error_rate=0.0,
+                 rate_limit=0.0, video_size=4 * 1024 * 1024, seed=0):
+        self.shows = shows
+        self.episodes_per_show = episodes_per_show
+        # Seconds added to every api response
+        self.latency = latency
+        # Fraction of api requests answered with a 503
+        self.error_rate = error_rate
+        # Api requests allowed per second before answering with a 420, 0 for no limit
+        self.rate_limit = rate_limit
+        self.video_size = video_size
+        self.seed = seed
+
+
+class Catalog:
+    """ The videos and shows served by the mock server. Episodes are spread over the
+        shows in publish order and more can be published while the server runs """
+    def __init__(self, options, base_url):
+        self.options = options
+        self.base_url = base_url
+        self.lock = threading.Lock()
+        self.videos = []
+        self.missing_media = set()
+        self.start_time = time.mktime((2015, 1, 1, 0, 0, 0, 0, 0, -1))
+        for _ in range(options.shows * options.episodes_per_show):
+            self.add_video((len(self.videos) % options.shows) + 1)
+
+    def add_video(self, show_id):
+        video_id = len(self.videos) + 1
+        video_type_id, video_type = VIDEO_TYPES[video_id % len(VIDEO_TYPES)]
+        publish_time = time.localtime(self.start_time + video_id * 3600)
+        video = dict(id=video_id,
+                     name="Show {0} Episode {1}".format(show_id, video_id),
+                     deck="Synthetic episode {0} of show {1}".format(video_id, show_id),
+                     length_seconds=600 + video_id % 3000,
+                     video_type=video_type,
+                     video_categories=[dict(id=video_type_id, name=video_type)],
+                     video_show=dict(id=show_id, title="Show {0}".format(show_id)),
+                     publish_date=time.strftime("%Y-%m-%d %H:%M:%S", publish_time),
+                     site_detail_url="{0}/videos/{1}/".format(self.base_url, video_id))
+        for quality in QUALITIES:
+            video[quality + "_url"] = "{0}/media/{1}_{2}.mp4".format(self.base_url, video_id, quality)
+        # Like the real site some videos have no hd version, or list one that doesn't exist
+        if video_id % 10 == 0:
+            video["hd_url"] = None
+        elif video_id % 10 == 5:
+            self.missing_media.add("/media/{0}_hd.mp4".format(video_id))
+        self.videos.append(video)
+        return video
+
+    def publish(self, count):
+        " Add count new episodes to every show "
+        with self.lock:
+            for _ in range(count):
+                for show_id in range(1, self.options.shows + 1):
+                    self.add_video(show_id)
+
+    def query(self, filter_string, sort):
+        " The videos matching an api filter string, sorted like the api would "
+        with self.lock:
+            videos = list(self.videos)
+
+        for condition in filter_string.split(","):
+            if ":" not in condition:
+                continue
+            field, value = condition.split(":", 1)
+            if field == "name":
+                videos = [video for video in videos if value.lower() in video["name"].lower()]
+            elif field == "id":
+                ids = set(int(video_id) for video_id in value.split("|"))
+                videos = [video for video in videos if video["id"] in ids]
+            elif field == "video_type":
+                types = set(int(video_type) for video_type in value.split("|"))
+                videos = [video for video in videos
+                          if any(category["id"] in types for category in video["video_categories"])]
+            elif field == "video_show":
+                shows = set(int(show_id) for show_id in value.split("|"))
+                videos = [video for video in videos if video["video_show"]["id"] in shows]
+            elif field == "publish_date":
+                start, end = value.split("|")
+                videos = [video for video in videos if start <= video["publish_date"] <= end]
+
+        field, direction = (sort or "id:asc").split(":")
+        videos.sort(key=lambda video: (video[field], video["id"]), reverse=direction == "desc")
+        return videos
+
+    def shows(self):
+        with self.lock:
+            latest = {}
+            for video in self.videos:
+                latest[video["video_show"]["id"]] = video
+        return [dict(id=show_id, title="Show {0}".format(show_id),
+                     deck="Synthetic show {0}".format(show_id), latest=[latest[show_id]])
+                for show_id in sorted(latest)]
+
+
+def video_block(path):
+    " The block of bytes a synthetic video is made from, different for every video "
+    digest = hashlib.sha256(path.encode("utf-8")).digest()
+    return (digest * (VIDEO_BLOCK_SIZE // len(digest)))[:VIDEO_BLOCK_SIZE]
+
+def video_bytes(path, start, end):
+    " Bytes start to end (inclusive) of a synthetic video "
+    block = video_block(path)
+    offset = start % VIDEO_BLOCK_SIZE
+    length = end - start + 1
+    repeated = block[offset:] + block * (length // VIDEO_BLOCK_SIZE + 1)
+    return repeated[:length]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == "/control/publish":
+            self.server.catalog.publish(int(query.get("count", ["1"])[0]))
+            self.send_json({"status_code": 1})
+        else:
+            self.send_empty(404)
+
+    def handle_request(self, send_body):
+        parts = urlsplit(self.path)
+        if parts.path in self.server.catalog.missing_media:
+            self.send_empty(404)
+        elif parts.path.startswith("/media/"):
+            self.send_video(parts.path, send_body)
+        elif parts.path.startswith("/api/"):
+            self.server.count_request()
+            if self.server.options.latency > 0:
+                time.sleep(self.server.options.latency)
+            if not self.server.allow_request():
+                self.send_empty(420)
+            elif random.random() < self.server.options.error_rate:
+                self.send_empty(503)
+            else:
+                self.send_api(parts.path, parse_qs(parts.query), send_body)
+        else:
+            self.send_empty(404)
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_json(self, obj, send_body=True):
+        body = json.dumps(obj).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_api(self, path, query, send_body):
+        catalog = self.server.catalog
+        if path == "/api/video_types/":
+            results = [dict(id=type_id, name=name, deck=name + " videos") for type_id, name in VIDEO_TYPES]
+        elif path == "/api/video_shows/":
+            results = catalog.shows()
+        elif path == "/api/videos/":
+            results = catalog.query(query.get("filter", [""])[0], query.get("sort", [None])[-1])
+        else:
+            self.send_json(dict(status_code=101, error="Object Not Found"), send_body)
+            return
+
+        offset = int(query.get("offset", ["0"])[0])
+        limit = min(int(query.get("limit", [str(API_PAGE_SIZE)])[0]), API_PAGE_SIZE)
+        page = results[offset:offset + limit]
+        self.send_json(dict(status_code=1, error="OK", limit=limit, offset=offset,
+                            number_of_page_results=len(page),
+                            number_of_total_results=len(results), results=page), send_body)
+
+    def send_video(self, path, send_body):
+        size = self.server.options.video_size
+        start = 0
+        end = size - 1
+        status = 200
+
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if match is not None:
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            end = min(end, size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{0}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"{0}-{1}"'.format(hashlib.sha1(path.encode("utf-8")).hexdigest(), size))
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, size))
+        self.end_headers()
+
+        if send_body:
+            position = start
+            while position <= end:
+                chunk_end = min(position + SEND_CHUNK_SIZE - 1, end)
+                self.wfile.write(video_bytes(path, position, chunk_end))
+                position = chunk_end + 1
+
+
+class MockServer(ThreadingHTTPServer):
+    " Serves the mock api and its videos, counting the api requests it receives "
+    daemon_threads = True
+
+    def __init__(self, options, port=0):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", port), MockHandler)
+        random.seed(options.seed)
+        self.options = options
+        self.lock = threading.Lock()
+        self.api_requests = 0
+        self.recent_requests = []
+        self.catalog = Catalog(options, "http://127.0.0.1:{0}".format(self.server_address[1]))
+
+    @property
+    def base_url(self):
+        return self.catalog.base_url
+
+    @property
+    def api_url(self):
+        return self.catalog.base_url + "/api"
+
+    def count_request(self):
+        with self.lock:
+            self.api_requests += 1
+
+    def allow_request(self):
+        " Apply the rate limit over a sliding one second window "
+        if self.options.rate_limit <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.recent_requests = [t for t in self.recent_requests if now - t < 1.0]
+            if len(self.recent_requests) >= self.options.rate_limit:
+                return False
+            self.recent_requests.append(now)
+            return True
+
+    def start(self):
+        " Serve from a background thread "
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    " Run the mock server until interrupted "
+    parser = argparse.ArgumentParser(description='Mock Giant Bomb API server')
+    parser.add_argument('--port', dest="port", type=int, default=8000)
+    parser.add_argument('--shows', dest="shows", type=int, default=5)
+    parser.add_argument('--episodes', dest="episodes", type=int, default=200,
+                        help="episodes per show, defaults to %(default)s")
+    parser.add_argument('--latency', dest="latency", type=float, default=0.0,
+                        help="seconds added to every api response")
+    parser.add_argument('--error_rate', dest="errorRate", type=float, default=0.0,
+                        help="fraction of api requests that fail with a 503")
+    parser.add_argument('--rate_limit', dest="rateLimit", type=float, default=0.0,
+                        help="api requests allowed per second, 0 for no limit")
+    parser.add_argument('--video_size', dest="videoSize", type=int, default=4 * 1024 * 1024,
+                        help="size of every video in bytes")
+    args = parser.parse_args()
+
+    options = MockOptions(args.shows, args.episodes, args.latency, args.errorRate,
+                          args.rateLimit, args.videoSize)
+    server = MockServer(options, args.port)
+    print("Serving mock api at " + server.api_url)
+    print("Run the cli with GIANT_BOMB_API_URL=" + server.api_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    main()
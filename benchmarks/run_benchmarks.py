@@ -0,0 +1,255 @@
+#! /usr/bin/python
+"  Times giant_bomb_cli.py against the local mock server and records the results  "
+from urllib.request import Request
+from urllib.request import urlopen
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_server import MockOptions
+from mock_server import MockServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+CLI_PATH = os.path.join(os.path.dirname(BENCHMARK_DIR), "giant_bomb_cli.py")
+RESULTS_LOCATION = os.path.join(BENCHMARK_DIR, "results.json")
+
+# Arguments given to every cli run so that the cli's own throttling and cache
+# don't hide the cost of the code being measured
+CLI_ARGS = ["--no-cache", "--rate", "1000", "--hourly_budget", "0"]
+
+COLOURS = {"Title": "\033[93m",
+           "Good": "\033[32m",
+           "Bad": "\033[31m",
+           "End": "\033[0m"}
+
+
+class Sandbox:
+    " A home directory with an api key and a working directory to run the cli in "
+    def __init__(self, server, extra_args):
+        self.server = server
+        self.extra_args = extra_args
+        self.root = tempfile.mkdtemp(prefix="gb_bench_")
+        self.home = os.path.join(self.root, "home")
+        self.work = os.path.join(self.root, "work")
+        os.makedirs(os.path.join(self.home, ".giant_bomb_cli"))
+        os.makedirs(self.work)
+        with open(os.path.join(self.home, ".giant_bomb_cli", "config"), "w") as config_file:
+            json.dump({"API_KEY": "benchmark"}, config_file)
+
+    def run(self, *args):
+        """ Run the cli with args and return how long it took and what it printed
+            Raises RuntimeError if the cli fails """
+        env = dict(os.environ, HOME=self.home, GIANT_BOMB_API_URL=self.server.api_url)
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, CLI_PATH] + list(args) + self.extra_args,
+                                 cwd=self.work, env=env, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        elapsed = time.perf_counter() - start
+        if process.returncode not in (0, None):
+            raise RuntimeError("cli exited with {0}: {1}".format(process.returncode, process.stderr))
+        return elapsed, process.stdout
+
+    def folder_size(self, folder):
+        total = 0
+        for root, dirs, files in os.walk(os.path.join(self.work, folder)):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def publish(server, count):
+    " Ask the mock server to publish count new episodes of every show "
+    urlopen(Request(server.base_url + "/control/publish?count={0}".format(count), data=b"")).read()
+
+def bench_listing(server, sandbox, settings):
+    " List the whole catalog as ndjson "
+    total = server.options.shows * server.options.episodes_per_show
+    elapsed, output = sandbox.run("-l", str(total), "--format", "ndjson")
+    records = len(output.splitlines())
+    return dict(seconds=elapsed, records=records, records_per_second=records / elapsed)
+
+def bench_pagination(server, sandbox, settings):
+    " Subscribe to a show, which pages through all of its episodes via get_episode_data "
+    elapsed, output = sandbox.run("--subscribe_to_show_id", "1", "--output", "show_1")
+    return dict(seconds=elapsed, episodes=server.options.episodes_per_show)
+
+def bench_subscription_sync(server, sandbox, settings):
+    " Publish new episodes of every subscribed show and download them "
+    for show_id in range(1, server.options.shows + 1):
+        sandbox.run("--subscribe_to_show_id", str(show_id), "--output", "show_{0}".format(show_id))
+    publish(server, settings.newEpisodes)
+
+    options = server.options
+    video_size = options.video_size
+    options.video_size = settings.syncVideoSize
+    try:
+        elapsed, output = sandbox.run("--download_subscriptions", "--jobs", str(settings.jobs))
+    finally:
+        options.video_size = video_size
+    return dict(seconds=elapsed, shows=options.shows,
+                new_episodes=options.shows * settings.newEpisodes)
+
+def bench_download(server, sandbox, settings):
+    " Download several large videos at once "
+    elapsed, output = sandbox.run("-l", str(settings.downloads), "--download", "--output", "downloads",
+                                  "--jobs", str(settings.jobs))
+    downloaded = sandbox.folder_size("downloads")
+    return dict(seconds=elapsed, bytes=downloaded, megabytes_per_second=downloaded / elapsed / 1048576.0)
+
+def bench_segmented_download(server, sandbox, settings):
+    " Download a single large video split into segments "
+    elapsed, output = sandbox.run("-l", "1", "--download", "--output", "downloads",
+                                  "--segments", str(settings.segments))
+    downloaded = sandbox.folder_size("downloads")
+    return dict(seconds=elapsed, bytes=downloaded, megabytes_per_second=downloaded / elapsed / 1048576.0)
+
+
+BENCHMARKS = [("listing", bench_listing),
+              ("pagination", bench_pagination),
+              ("subscription_sync", bench_subscription_sync),
+              ("download", bench_download),
+              ("segmented_download", bench_segmented_download)]
+
+def run_benchmark(name, benchmark, settings):
+    """ Run a benchmark settings.repeat times, each against a fresh mock server
+        and sandbox, and summarise the runs with their median """
+    runs = []
+    api_requests = []
+    for _ in range(settings.repeat):
+        options = MockOptions(settings.shows, settings.episodes, settings.latency,
+                              settings.errorRate, settings.rateLimit, settings.videoSize)
+        server = MockServer(options).start()
+        sandbox = Sandbox(server, CLI_ARGS + settings.cliArgs)
+        try:
+            runs.append(benchmark(server, sandbox, settings))
+            api_requests.append(server.api_requests)
+        finally:
+            sandbox.close()
+            server.shutdown()
+            server.server_close()
+
+    summary = {}
+    for key in runs[0]:
+        summary[key] = statistics.median(run[key] for run in runs)
+    summary["runs"] = [run["seconds"] for run in runs]
+    summary["api_requests"] = statistics.median(api_requests)
+    return summary
+
+def get_version():
+    " The git revision being measured, or a hash of the cli if git isn't available "
+    try:
+        revision = subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                           cwd=os.path.dirname(CLI_PATH), stderr=subprocess.DEVNULL)
+        return revision.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        with open(CLI_PATH, "rb") as cli_file:
+            return hashlib.sha1(cli_file.read()).hexdigest()[:12]
+
+def load_results(path):
+    try:
+        with open(path) as results_file:
+            return json.load(results_file)
+    except (OSError, ValueError):
+        return []
+
+def compare(previous, current, threshold):
+    """ Print how each benchmark changed since the previous run with the same settings
+        Returns the names of the benchmarks that got slower by more than threshold """
+    regressions = []
+    for name, result in current["results"].items():
+        line = "{0:<20} {1:8.3f}s".format(name, result["seconds"])
+        if previous is not None and name in previous["results"]:
+            before = previous["results"][name]["seconds"]
+            change = (result["seconds"] - before) / before if before > 0 else 0.0
+            colour = COLOURS["Good"]
+            if change > threshold:
+                colour = COLOURS["Bad"]
+                regressions.append(name)
+            line += " {0}{1:+7.1%}{2} (was {3:.3f}s at {4})".format(colour, change, COLOURS["End"],
+                                                                   before, previous["version"])
+        extras = ["{0}={1:.1f}".format(key, value) for key, value in sorted(result.items())
+                  if key not in ("seconds", "runs")]
+        print(line + "  " + " ".join(extras))
+    return regressions
+
+def main():
+    " Main entry point "
+    parser = argparse.ArgumentParser(description='Benchmark giant_bomb_cli.py against a mock server')
+    parser.add_argument('--benchmarks', dest="benchmarks", action="store",
+                        default=",".join(name for name, benchmark in BENCHMARKS),
+                        help="comma separated benchmarks to run, defaults to all of them")
+    parser.add_argument('--repeat', dest="repeat", type=int, default=3,
+                        help="how many times to run each benchmark, defaults to %(default)s")
+    parser.add_argument('--shows', dest="shows", type=int, default=5)
+    parser.add_argument('--episodes', dest="episodes", type=int, default=400,
+                        help="episodes per show, defaults to %(default)s")
+    parser.add_argument('--latency', dest="latency", type=float, default=0.05,
+                        help="seconds the mock server adds to api responses, defaults to %(default)s")
+    parser.add_argument('--error_rate', dest="errorRate", type=float, default=0.0,
+                        help="fraction of api requests that fail, defaults to %(default)s")
+    parser.add_argument('--rate_limit', dest="rateLimit", type=float, default=0.0,
+                        help="api requests per second the mock server allows, 0 for no limit")
+    parser.add_argument('--video_size', dest="videoSize", type=int, default=64 * 1024 * 1024,
+                        help="size of the videos downloaded, defaults to %(default)s")
+    parser.add_argument('--sync_video_size', dest="syncVideoSize", type=int, default=1024 * 1024,
+                        help="size of the videos downloaded by the subscription sync")
+    parser.add_argument('--new_episodes', dest="newEpisodes", type=int, default=2,
+                        help="episodes published per show before the subscription sync")
+    parser.add_argument('--downloads', dest="downloads", type=int, default=4,
+                        help="videos fetched by the download benchmark, defaults to %(default)s")
+    parser.add_argument('--jobs', dest="jobs", type=int, default=4)
+    parser.add_argument('--segments', dest="segments", type=int, default=4)
+    parser.add_argument('--cli_args', dest="cliArgs", action="store", default="",
+                        help="extra arguments passed to every cli run")
+    parser.add_argument('--results', dest="results", action="store", default=RESULTS_LOCATION,
+                        help="file the results are added to, defaults to %(default)s")
+    parser.add_argument('--threshold', dest="threshold", type=float, default=0.10,
+                        help="slowdown reported as a regression, defaults to %(default)s")
+    args = parser.parse_args()
+    args.cliArgs = args.cliArgs.split()
+
+    selected = args.benchmarks.split(",")
+    unknown = set(selected) - set(name for name, benchmark in BENCHMARKS)
+    if unknown:
+        print("Unknown benchmarks: " + ", ".join(sorted(unknown)))
+        return 1
+
+    settings = dict((key, value) for key, value in vars(args).items()
+                    if key not in ("benchmarks", "results", "threshold"))
+    current = dict(version=get_version(), timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
+                   settings=settings, results={})
+
+    print(COLOURS["Title"] + "Benchmarking " + current["version"] + COLOURS["End"])
+    for name, benchmark in BENCHMARKS:
+        if name in selected:
+            current["results"][name] = run_benchmark(name, benchmark, args)
+
+    history = load_results(args.results)
+    previous = None
+    for result in reversed(history):
+        if result["settings"] == settings:
+            previous = result
+            break
+
+    regressions = compare(previous, current, args.threshold)
+    history.append(current)
+    with open(args.results, "w") as results_file:
+        json.dump(history, results_file, indent=2)
+
+    if regressions:
+        print(COLOURS["Bad"] + "Slower than before: " + ", ".join(regressions) + COLOURS["End"])
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
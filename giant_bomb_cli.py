@@ -2,74 +2,132 @@
 "  Command line utility for downloading and streaming videos from Giant Bomb!  "
 from urllib.error import URLError
 from urllib.error import HTTPError
-from urllib.request import urlopen
-from urllib.request import urlretrieve
+from urllib.parse import parse_qsl
+from urllib.parse import quote
+from urllib.parse import unquote
+from urllib.parse import urlencode
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+# http.client, http.server, sqlite3, csv, gzip, subprocess, tempfile and
+# concurrent.futures are imported where they're used, so importing this module
+# as a library stays quick
+import hashlib
 import json
-import argparse
-from subprocess import call
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain
+import errno
 import os
+import random
+import re
+import shutil
 import sys
+import threading
+import time
+
+# Subscriptions are kept in the directory the tool is run from
+SHOWS_JSON_LOCATION = "shows.json"
+SHOWS_DB_LOCATION = "shows.db"
+SHOWS_DB_VERSION = 2
+# Episodes read from the subscription store at a time
+SUBSCRIPTION_FETCH_SIZE = 500
+# Subscribed shows whose new episodes are asked for in a single query
+SUBSCRIPTION_BATCH_SIZE = 25
+# Seconds apart the watermarks of shows asked about together can be, so a show
+# that's gone quiet doesn't pull the old episodes of the rest of its batch
+SUBSCRIPTION_BATCH_WINDOW = 7 * 24 * 60 * 60
+# Seconds a worker may hold a queued download without renewing its lease
+QUEUE_LEASE = 120
+# Seconds between a worker's lease renewals
+QUEUE_HEARTBEAT = 30
+# Seconds an idle worker waits before looking for work again
+QUEUE_POLL = 10
+# Times a queued download is tried before it's given up on
+QUEUE_ATTEMPTS = 3
+# Recent episodes of a show used to work out how often it publishes
+WATCH_HISTORY = 10
+# Seconds between checks of a show, the shortest matches how long episode lists are cached
+WATCH_MIN_INTERVAL = 15 * 60
+WATCH_DUE_INTERVAL = 60 * 60
+WATCH_MAX_INTERVAL = 24 * 60 * 60
+# Assumed time between episodes of a show that doesn't have two yet
+WATCH_DEFAULT_GAP = 7 * 24 * 60 * 60
+# Seconds between looks at the store for new subscriptions
+WATCH_RESCAN = 60
+
+
+# Characters removed from a publish date to turn it into a number
+PUBLISH_DATE_SEPARATORS = str.maketrans("", "", "-: ")
+
+def parse_publish_date(publish_date):
+    " Turn an API publish date, YYYY-MM-DD HH:MM:SS, into a sortable number, YYYYMMDDHHMMSS "
+    if publish_date is None or isinstance(publish_date, int):
+        return publish_date
+    return int(publish_date.translate(PUBLISH_DATE_SEPARATORS))
+
+def get_publish_time(published):
+    " Turn a number from parse_publish_date into seconds since the epoch, in local time "
+    return time.mktime(time.strptime("{0:014d}".format(published), "%Y%m%d%H%M%S"))
+
+def format_publish_date(published):
+    " Turn a number from parse_publish_date back into a publish date "
+    if published is None:
+        return None
+    digits = "{0:014d}".format(published)
+    return "{0}-{1}-{2} {3}:{4}:{5}".format(digits[0:4], digits[4:6], digits[6:8],
+                                           digits[8:10], digits[10:12], digits[12:14])
 
 
 class EpisodeInfo:
+    # Tens of thousands of episodes can be loaded at once, so they have no
+    # per-instance dict and keep their publish date as a number
+    __slots__ = ("video_name", "video_id", "published", "hd_url", "high_url", "low_url",
+                 "downloaded_or_skiped")
+
     def __init__(self, video_name, video_id, publish_date, hd_url, high_url, low_url, downloaded_or_skiped=True):
         self.downloaded_or_skiped = downloaded_or_skiped
         self.video_name = video_name
         self.video_id = video_id
-        self.publish_date = publish_date
+        self.published = parse_publish_date(publish_date)
         self.hd_url = hd_url
         self.high_url = high_url
         self.low_url = low_url
 
-    def reprJSON(self):
-        return dict(video_name=self.video_name, downloaded_or_skiped=self.downloaded_or_skiped, video_id=self.video_id, publish_date=self.publish_date, hd_url=self.hd_url, high_url=self.high_url, low_url=self.low_url)
+    @property
+    def publish_date(self):
+        return format_publish_date(self.published)
+
+    @classmethod
+    def fromJson(cls, episode):
+        " Build an episode from its shows.json form "
+        return cls(episode["video_name"], episode["video_id"], episode["publish_date"], episode["hd_url"],
+                   episode["high_url"], episode["low_url"], episode["downloaded_or_skiped"])
 
 
 class ShowInfo:
+    __slots__ = ("show_id", "episodes", "download_folder")
+
     def __init__(self, show_id, episodes, download_folder):
         self.show_id = show_id
         self.episodes = []
         self.download_folder = download_folder
         for episode in episodes:
             if not hasattr(episode, "video_id"):
-                self.episodes.append(EpisodeInfo(episode["video_name"], episode["video_id"], episode["publish_date"], episode["hd_url"],
-                                    episode["high_url"], episode["low_url"], episode["downloaded_or_skiped"]))
+                self.episodes.append(EpisodeInfo.fromJson(episode))
             else:
                 self.episodes.append(episode)
 
-    def reprJSON(self):
-        return dict(show_id=self.show_id, episodes=self.episodes, download_folder=self.download_folder)
-
-    def get_latest_date(self):
-        latest_episode_date = "1/1/1800"
-        for episode in self.episodes:
-            if episode.publish_date > latest_episode_date:
-                latest_episode_date = episode.publish_date
-        return latest_episode_date
-
-    def contains_show_id(self, show_id):
-        if self.show_id == show_id:
-            return True
-        else:
-            return False
-
 
 class Show:
+    __slots__ = ("show",)
+
     def __init__(self, show):
         if not hasattr(show, "show_id"):
             self.show = ShowInfo(show["show_id"], show["episodes"], show["download_folder"])
         else:
             self.show = show
 
-    def reprJSON(self):
-        return dict(show=self.show)
-
-    def contains_show_id(self, show_id):
-        return self.show.contains_show_id(show_id)
-
-    def get_latest_date(self):
-        return self.show.get_latest_date()
-
 
 class Shows:
     def __init__(self):
@@ -77,27 +135,181 @@ class Shows:
 
     def fromJson(self, j):
         self.shows = []
-        js = json.loads(j)
+        # Episodes are built as soon as each one is parsed rather than from a
+        # complete tree of dicts afterwards
+        js = json.loads(j, object_hook=lambda obj: EpisodeInfo.fromJson(obj) if "video_id" in obj else obj)
         for show in js["shows"]:
             self.shows.append(Show(show["show"]))
         return self
 
-    def reprJSON(self):
-        return dict(shows=self.shows)
 
-    def contains_show_id(self, show_id):
-        for show in self.shows:
-            if show.contains_show_id(show_id):
-                return show
-        return False
+class APIError(Exception):
+    " Raised when the Giant Bomb API can't give us the data we asked for "
+
+
+class SubscriptionStore:
+    """ The subscribed shows and their episodes, kept in an SQLite database with
+        indexed lookups by show and video id. Each change is committed in its own
+        transaction so a crash can't lose or corrupt the rest of the library """
+    def __init__(self, path=SHOWS_DB_LOCATION):
+        self.lock = threading.RLock()
+        import sqlite3
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS shows ("
+                                    "show_id TEXT PRIMARY KEY, download_folder TEXT, "
+                                    "latest_publish_date TEXT, latest_video_id INTEGER)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS episodes ("
+                                    "show_id TEXT NOT NULL REFERENCES shows (show_id), "
+                                    "video_id INTEGER NOT NULL, video_name TEXT, publish_date TEXT, "
+                                    "hd_url TEXT, high_url TEXT, low_url TEXT, "
+                                    "downloaded_or_skiped INTEGER NOT NULL, "
+                                    "published INTEGER NOT NULL DEFAULT 0, "
+                                    "PRIMARY KEY (show_id, video_id))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS episodes_by_video_id "
+                                    "ON episodes (video_id)")
+            self.upgrade_schema()
+            self.connection.execute("CREATE INDEX IF NOT EXISTS episodes_by_show_published "
+                                    "ON episodes (show_id, published, video_id)")
+
+    def upgrade_schema(self):
+        " Bring databases written by older versions up to date, inside a transaction "
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # Version 1 added the per-show watermark
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(shows)")]
+            if "latest_publish_date" not in columns:
+                self.connection.execute("ALTER TABLE shows ADD COLUMN latest_publish_date TEXT")
+                self.connection.execute("ALTER TABLE shows ADD COLUMN latest_video_id INTEGER")
+            self.connection.execute("UPDATE shows SET (latest_publish_date, latest_video_id) = "
+                                    "(SELECT publish_date, video_id FROM episodes "
+                                    "WHERE episodes.show_id = shows.show_id "
+                                    "ORDER BY publish_date DESC, video_id DESC LIMIT 1)")
+        if version < 2:
+            # Version 2 added publish dates parsed into sortable numbers
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(episodes)")]
+            if "published" not in columns:
+                self.connection.execute("ALTER TABLE episodes ADD COLUMN "
+                                        "published INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("UPDATE episodes SET published = coalesce(CAST(replace(replace("
+                                    "replace(publish_date, '-', ''), ':', ''), ' ', '') AS INTEGER), 0)")
+        self.connection.execute("PRAGMA user_version = {0}".format(SHOWS_DB_VERSION))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
 
-
-class ComplexEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if hasattr(obj, 'reprJSON'):
-            return obj.reprJSON()
-        else:
-            return json.JSONEncoder.default(self, obj)
+    def contains_show_id(self, show_id):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM shows WHERE show_id = ?",
+                                          (show_id,)).fetchone()
+        return row is not None
+
+    def show_ids(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT show_id FROM shows")]
+
+    def get_download_folder(self, show_id):
+        with self.lock:
+            row = self.connection.execute("SELECT download_folder FROM shows WHERE show_id = ?",
+                                          (show_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get_watermark(self, show_id):
+        """ The publish date and video id of the newest episode we know about for
+            the show, (None, None) if we don't have any """
+        with self.lock:
+            row = self.connection.execute("SELECT latest_publish_date, latest_video_id FROM shows "
+                                          "WHERE show_id = ?", (show_id,)).fetchone()
+        return tuple(row) if row is not None else (None, None)
+
+    def get_episodes(self, show_id, pending_only=False):
+        """ Generates the episodes of a show in publish order, optionally only those
+            not yet downloaded. They're read SUBSCRIPTION_FETCH_SIZE at a time, with
+            the lock only held while each batch is read """
+        query = ("SELECT video_name, video_id, published, hd_url, high_url, low_url, "
+                 "downloaded_or_skiped FROM episodes WHERE show_id = ? "
+                 "AND (published, video_id) > (?, ?)")
+        if pending_only:
+            query += " AND downloaded_or_skiped = 0"
+        query += " ORDER BY published, video_id LIMIT ?"
+
+        after = (-1, -1)
+        while True:
+            with self.lock:
+                rows = self.connection.execute(query, (show_id,) + after +
+                                               (SUBSCRIPTION_FETCH_SIZE,)).fetchall()
+            for row in rows:
+                yield EpisodeInfo(*row)
+            if len(rows) < SUBSCRIPTION_FETCH_SIZE:
+                return
+            after = (rows[-1][2], rows[-1][1])
+
+    def get_publish_history(self, show_id, count):
+        " The publish dates of the show's newest count episodes, newest first "
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT published FROM episodes WHERE show_id = ? AND published > 0 "
+                "ORDER BY published DESC LIMIT ?", (show_id, count))]
+
+    def add_show(self, show_info):
+        " Add a show and all of its episodes in one transaction "
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO shows (show_id, download_folder) VALUES (?, ?)",
+                                    (show_info.show_id, show_info.download_folder))
+            self.insert_episodes(show_info.show_id, show_info.episodes)
+
+    def add_episodes(self, show_id, episodes):
+        # Read a generator of episodes before taking the lock
+        episodes = list(episodes)
+        with self.lock, self.connection:
+            self.insert_episodes(show_id, episodes)
+
+    def insert_episodes(self, show_id, episodes):
+        """ Must be called inside a transaction, episodes we already have are left alone
+            and the show's watermark moves forward to the newest episode """
+        if not episodes:
+            return
+        self.connection.executemany("INSERT OR IGNORE INTO episodes (show_id, video_id, video_name, "
+                                    "publish_date, hd_url, high_url, low_url, downloaded_or_skiped, "
+                                    "published) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    [(show_id, episode.video_id, episode.video_name,
+                                      episode.publish_date, episode.hd_url, episode.high_url,
+                                      episode.low_url, int(episode.downloaded_or_skiped),
+                                      episode.published or 0)
+                                     for episode in episodes])
+
+        latest = max(episodes, key=lambda episode: (episode.published, episode.video_id))
+        self.connection.execute("UPDATE shows SET latest_publish_date = ?, latest_video_id = ? "
+                                "WHERE show_id = ? AND (latest_publish_date IS NULL "
+                                "OR latest_publish_date < ? "
+                                "OR (latest_publish_date = ? AND latest_video_id < ?))",
+                                (latest.publish_date, latest.video_id, show_id, latest.publish_date,
+                                 latest.publish_date, latest.video_id))
+
+    def mark_downloaded(self, show_id, video_id):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE episodes SET downloaded_or_skiped = 1 "
+                                    "WHERE show_id = ? AND video_id = ?", (show_id, video_id))
+
+    def migrate_json(self, json_path=SHOWS_JSON_LOCATION):
+        """ Import the shows.json written by older versions, the file is renamed
+            afterwards so the import only ever happens once """
+        if not os.path.isfile(json_path):
+            return
+        with open(json_path) as json_file:
+            shows = Shows().fromJson(json_file.read())
+
+        with self.lock, self.connection:
+            for show in shows.shows:
+                self.connection.execute("INSERT OR IGNORE INTO shows (show_id, download_folder) "
+                                        "VALUES (?, ?)", (show.show.show_id, show.show.download_folder))
+                self.insert_episodes(show.show.show_id, show.show.episodes)
+
+        os.replace(json_path, json_path + ".migrated")
+        gb_log(COLOURS["Desc"], "Imported {0} shows from {1}".format(len(shows.shows), json_path))
 
 
 COLOURS = {"Desc": "\033[94m",
@@ -106,9 +318,17 @@ COLOURS = {"Desc": "\033[94m",
            "Debug": "\033[32m",
            "End": "\033[0m"}
 
+# The video fields written by --format csv
+CSV_FIELDS = ["id", "name", "deck", "video_type", "length_seconds", "publish_date",
+              "hd_url", "high_url", "low_url", "site_detail_url"]
+
 VIDEO_QUALITIES = {"low",
                    "high",
-                   "hd", }
+                   "hd",
+                   "best", }
+
+# Best first, the order other qualities are tried in when the one asked for isn't available
+QUALITY_ORDER = ["hd", "high", "low"]
 
 STATUS_CODES = {1: "OK",
                 100: "Invalid API Key",
@@ -120,22 +340,719 @@ STATUS_CODES = {1: "OK",
 
 CONFIG_LOCATION = os.path.expanduser("~/.giant_bomb_cli")
 
-def gb_log(colour, string):
-    " Log a string with a specified colour "
-    print(colour + string + COLOURS["End"])
+# Can be pointed at another server, such as the benchmarks' mock server
+API_URL = os.environ.get("GIANT_BOMB_API_URL", "https://www.giantbomb.com/api").rstrip("/")
+
+DOWNLOAD_ATTEMPTS = 5
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Downloads are read straight into a buffer of this size and written out unbuffered
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+# When downloaded data is flushed to disk, see DownloadSettings
+FSYNC_POLICIES = ["never", "end", "checkpoint"]
+# Seconds between redraws of the download progress line
+PROGRESS_INTERVAL = 0.25
+# How much data is written between saves of a partial download's state
+STATE_SAVE_INTERVAL = 8 * 1024 * 1024
+# Files smaller than this are never split into segments
+SEGMENT_MIN_SIZE = 32 * 1024 * 1024
+
+# How much of the next video in a playlist is fetched while the current one plays
+STREAM_PREFETCH_SIZE = 16 * 1024 * 1024
+# Seconds the player is kept waiting for data before giving up
+STREAM_WAIT = 60
+# The player seeking further than this past what has been fetched is served from the server
+STREAM_DIRECT_DISTANCE = 8 * 1024 * 1024
+
+# The most results the API will return in one page
+API_PAGE_SIZE = 100
+# How many pages of a show's episodes are requested at once
+PAGE_JOBS = 4
+# How many of the searches in a --batch file are run at once
+BATCH_JOBS = 4
+# Bounds of the publish date ranges used when filtering by date
+EARLIEST_PUBLISH_DATE = "0001-01-01 00:00:00"
+LATEST_PUBLISH_DATE = "9999-12-31 23:59:59"
+
+CATALOG_LOCATION = CONFIG_LOCATION + "/catalog.db"
+# Rows read from the catalog at a time while answering a query
+CATALOG_FETCH_SIZE = 500
+
+LIBRARY_LOCATION = CONFIG_LOCATION + "/library.db"
+LIBRARY_HASH_BLOCK_SIZE = 1024 * 1024
+
+PROBE_LOCATION = CONFIG_LOCATION + "/probes.json"
+# How long the result of checking whether a video file exists is trusted
+PROBE_TTL = 7 * 24 * 60 * 60
+# HEAD requests made at once while probing
+PROBE_JOBS = 8
+
+HTTP_TIMEOUT = 30
+# Idle keep-alive connections kept open per host
+HTTP_MAX_IDLE = 16
+HTTP_MAX_REDIRECTS = 5
+# Unread response bodies smaller than this are drained so the connection can be reused
+HTTP_DRAIN_LIMIT = 64 * 1024
+
+CACHE_LOCATION = CONFIG_LOCATION + "/cache"
+CACHE_MAX_SIZE = 64 * 1024 * 1024
+# How long responses from each API endpoint are used without asking the server
+CACHE_TTLS = {"video_types": 7 * 24 * 60 * 60,
+              "video_shows": 24 * 60 * 60,
+              "videos": 15 * 60, }
+
+QUOTA_LOCATION = CONFIG_LOCATION + "/quota.json"
+# Giant Bomb allows 200 requests to each resource per hour
+API_HOURLY_BUDGET = 200
+# Requests per second, and how many may be made at once after a quiet spell
+API_RATE = 1.0
+API_BURST = 5
+API_ATTEMPTS = 5
+# Retries wait a random time up to API_BACKOFF * 2^attempt seconds
+API_BACKOFF = 2.0
+API_BACKOFF_MAX = 120.0
+# 420 is Giant Bomb's "Enhance Your Calm" rate limit response
+RETRY_STATUS_CODES = {420, 429, 500, 502, 503, 504}
+
+
+class Console:
+    """ Serialises terminal output so that log lines from concurrent downloads
+        don't tangle with each other or with the progress status line """
+    def __init__(self, stream=sys.stdout):
+        self.lock = threading.RLock()
+        self.status = ""
+        self.set_stream(stream)
+
+    def set_stream(self, stream):
+        " Send log output somewhere else, such as stderr when stdout carries data "
+        self.stream = stream
+        self.interactive = stream.isatty()
+
+    def log(self, string):
+        with self.lock:
+            if self.status:
+                self.stream.write("\r\033[K")
+            print(string, file=self.stream)
+            if self.status:
+                self.stream.write(self.status)
+            self.stream.flush()
+
+    def set_status(self, status):
+        if not self.interactive:
+            return
+        with self.lock:
+            self.stream.write("\r\033[K" + status)
+            self.stream.flush()
+            self.status = status
+
+    def clear_status(self):
+        self.set_status("")
+
+
+CONSOLE = Console()
+
+
+class Metrics:
+    """ Records where a run spends its time: the latency and size of each api
+        request, retries, cache use, download transfers and the phases of a
+        subscription sync. Written out at the end of the run with --metrics-file """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # endpoint -> {"latencies": [...], "errors": n, "bytes": n, "retries": n}
+        self.requests = {}
+        self.cache = {"hit": 0, "revalidated": 0, "miss": 0}
+        self.downloads = {"succeeded": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+        # (start, end) of each download, to tell how long any were running for
+        self.download_spans = []
+        self.phases = {}
+
+    def get_endpoint(self, endpoint):
+        " Must be called with the lock held "
+        if endpoint not in self.requests:
+            self.requests[endpoint] = dict(latencies=[], errors=0, bytes=0, retries=0)
+        return self.requests[endpoint]
+
+    def record_request(self, endpoint, seconds, status):
+        " Record one attempt at an api request, status is the HTTP status or None if it failed to connect "
+        with self.lock:
+            stats = self.get_endpoint(endpoint)
+            stats["latencies"].append(seconds)
+            if status is None or status >= 400:
+                stats["errors"] += 1
+
+    def record_response_bytes(self, endpoint, size):
+        with self.lock:
+            self.get_endpoint(endpoint)["bytes"] += size
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self.get_endpoint(endpoint)["retries"] += 1
+
+    def record_cache(self, outcome):
+        with self.lock:
+            self.cache[outcome] += 1
+
+    def record_transfer(self, size):
+        with self.lock:
+            self.downloads["bytes"] += size
+
+    def record_download(self, seconds, success):
+        " Record a download that has just ended after taking seconds "
+        end = time.monotonic()
+        with self.lock:
+            self.downloads["succeeded" if success else "failed"] += 1
+            self.downloads["seconds"] += seconds
+            self.download_spans.append((end - seconds, end))
+
+    @contextmanager
+    def phase(self, name):
+        " Time a block of work, repeated phases add up "
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+    @staticmethod
+    def covered_seconds(spans):
+        " How long at least one of the (start, end) spans was in progress "
+        total = 0.0
+        covered_until = None
+        for start, end in sorted(spans):
+            if covered_until is not None:
+                start = max(start, covered_until)
+            if end > start:
+                total += end - start
+            covered_until = end if covered_until is None else max(covered_until, end)
+        return total
+
+    @staticmethod
+    def percentile(values, fraction):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+    def summary(self):
+        " Everything recorded so far as a dict "
+        with self.lock:
+            requests = {}
+            for endpoint, stats in self.requests.items():
+                latencies = stats["latencies"]
+                requests[endpoint] = dict(count=len(latencies), errors=stats["errors"],
+                                          retries=stats["retries"], bytes=stats["bytes"],
+                                          latency_seconds=dict(total=sum(latencies),
+                                                               p50=self.percentile(latencies, 0.5),
+                                                               p95=self.percentile(latencies, 0.95),
+                                                               max=max(latencies, default=0.0)))
+            downloads = dict(self.downloads)
+            # Downloads run side by side, so throughput is over the time any were running
+            active = self.covered_seconds(self.download_spans)
+            downloads["active_seconds"] = active
+            downloads["bytes_per_second"] = downloads["bytes"] / active if active > 0 else 0.0
+            downloads["per_download_bytes_per_second"] = downloads["bytes"] / downloads["seconds"] \
+                if downloads["seconds"] > 0 else 0.0
+            return dict(started=self.started, duration_seconds=time.time() - self.started,
+                        requests=requests, cache=dict(self.cache), downloads=downloads,
+                        phases=dict(self.phases))
+
+    def to_prometheus(self):
+        " Everything recorded so far in the Prometheus text exposition format "
+        summary = self.summary()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            name = "giant_bomb_cli_" + name
+            lines.append("# HELP {0} {1}".format(name, help_text))
+            lines.append("# TYPE {0} {1}".format(name, metric_type))
+            for labels, value in samples:
+                label_text = ",".join('{0}="{1}"'.format(key, value) for key, value in labels)
+                lines.append("{0}{1} {2}".format(name, "{" + label_text + "}" if label_text else "",
+                                                 repr(float(value))))
+
+        requests = sorted(summary["requests"].items())
+        metric("last_run_timestamp_seconds", "gauge", "When the run started",
+               [((), summary["started"])])
+        metric("run_duration_seconds", "gauge", "How long the run took",
+               [((), summary["duration_seconds"])])
+        metric("api_requests_total", "counter", "Api requests made, including retries",
+               [((("endpoint", endpoint),), stats["count"]) for endpoint, stats in requests])
+        metric("api_request_errors_total", "counter", "Api requests that failed",
+               [((("endpoint", endpoint),), stats["errors"]) for endpoint, stats in requests])
+        metric("api_request_retries_total", "counter", "Api requests that were retried",
+               [((("endpoint", endpoint),), stats["retries"]) for endpoint, stats in requests])
+        metric("api_response_bytes_total", "counter", "Size of the api responses received",
+               [((("endpoint", endpoint),), stats["bytes"]) for endpoint, stats in requests])
+        latency_samples = []
+        for endpoint, stats in requests:
+            latency = stats["latency_seconds"]
+            latency_samples.append(((("endpoint", endpoint), ("quantile", "0.5")), latency["p50"]))
+            latency_samples.append(((("endpoint", endpoint), ("quantile", "0.95")), latency["p95"]))
+        metric("api_request_latency_seconds", "gauge", "Time until the api responded",
+               latency_samples)
+        metric("cache_lookups_total", "counter", "Api responses by how the cache answered them",
+               [((("result", result),), count) for result, count in sorted(summary["cache"].items())])
+        downloads = summary["downloads"]
+        metric("downloads_total", "counter", "Videos downloaded",
+               [((("result", "succeeded"),), downloads["succeeded"]),
+                ((("result", "failed"),), downloads["failed"])])
+        metric("download_bytes_total", "counter", "Bytes of video transferred",
+               [((), downloads["bytes"])])
+        metric("download_seconds_total", "counter", "Time spent downloading, summed over every video",
+               [((), downloads["seconds"])])
+        metric("download_active_seconds", "gauge", "Time at least one video was being downloaded",
+               [((), downloads["active_seconds"])])
+        metric("download_bytes_per_second", "gauge",
+               "Bytes of video transferred per second while downloading",
+               [((), downloads["bytes_per_second"])])
+        metric("download_per_video_bytes_per_second", "gauge",
+               "Bytes of video transferred per second by an average download",
+               [((), downloads["per_download_bytes_per_second"])])
+        metric("phase_seconds", "gauge", "Time spent in each phase of the run",
+               [((("phase", phase),), seconds) for phase, seconds in sorted(summary["phases"].items())])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, metrics_format=None):
+        """ Atomically write the metrics to path, as Prometheus text if the format
+            says so or the file ends in .prom, otherwise as JSON """
+        if metrics_format is None:
+            metrics_format = "prometheus" if path.endswith(".prom") else "json"
+        if metrics_format == "prometheus":
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=4, sort_keys=True) + "\n"
+
+        try:
+            with open(path + ".tmp", "w") as metrics_file:
+                metrics_file.write(content)
+            os.replace(path + ".tmp", path)
+        except OSError as exception:
+            gb_log(COLOURS["Error"], "Failed to write metrics to " + path + ": " + str(exception))
+
+
+METRICS = Metrics()
+
+
+class SessionResponse:
+    """ A response from an HTTPSession, closing it hands the connection back
+        to the pool if it can be reused """
+    def __init__(self, session, key, connection, response, url):
+        self.session = session
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def read_decoded(self):
+        """ Read the whole body, undoing any content encoding
+            Raises HTTPException or OSError if it can't be read in full """
+        body = self.response.read()
+        if self.headers.get("Content-Encoding") == "gzip":
+            import gzip
+            import zlib
+            from http.client import HTTPException
+            try:
+                body = gzip.decompress(body)
+            except (EOFError, zlib.error) as exception:
+                raise HTTPException("bad gzip body: " + str(exception))
+        return body
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        self.connection = None
+
+        if not self.response.isclosed():
+            if self.response.length is not None and self.response.length <= HTTP_DRAIN_LIMIT:
+                from http.client import HTTPException
+                try:
+                    self.response.read()
+                except (HTTPException, OSError):
+                    connection.close()
+                    return
+            else:
+                # Not worth reading the rest of a large body just to keep the connection
+                self.response.close()
+                connection.close()
+                return
 
-def file_exists_on_server(url):
-    " Make the server request "
-    try:
-        urlopen(url)
-    except URLError:
-        return False
+        if self.response.will_close:
+            connection.close()
+        else:
+            self.session.release(self.key, connection)
 
-    return True
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HTTPSession:
+    """ A pool of keep-alive connections shared by every request the tool makes,
+        so repeated requests to the same host skip the TCP and TLS handshakes.
+        Requests go through the proxies set in http_proxy, https_proxy and
+        no_proxy like urllib's would """
+    def __init__(self, timeout=HTTP_TIMEOUT, max_idle=HTTP_MAX_IDLE):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+        # scheme -> proxy url, read from the environment on the first request
+        self.proxies = None
+
+    def get_proxy(self, scheme, host):
+        " The url of the proxy to reach host through, or None to connect directly "
+        from urllib.request import getproxies
+        from urllib.request import proxy_bypass
+        if self.proxies is None:
+            self.proxies = getproxies()
+        proxy = self.proxies.get(scheme)
+        if not proxy or proxy_bypass(host):
+            return None
+        return proxy if "://" in proxy else "http://" + proxy
+
+    @staticmethod
+    def get_proxy_headers(proxy):
+        " The Proxy-Authorization header for a proxy url with a user name in it "
+        parts = urlsplit(proxy)
+        if parts.username is None:
+            return {}
+        import base64
+        credentials = unquote(parts.username) + ":" + unquote(parts.password or "")
+        token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        return {"Proxy-Authorization": "Basic " + token}
+
+    def get_connection(self, key):
+        " Returns an idle connection to the host if there is one, or a new one "
+        with self.lock:
+            pool = self.idle.get(key)
+            if pool:
+                self.reused += 1
+                return pool.pop(), True
+            self.opened += 1
+
+        from http.client import HTTPConnection
+        from http.client import HTTPSConnection
+        scheme, host, port, proxy = key
+        if proxy is None:
+            if scheme == "https":
+                return HTTPSConnection(host, port, timeout=self.timeout), False
+            return HTTPConnection(host, port, timeout=self.timeout), False
+
+        proxy_parts = urlsplit(proxy)
+        if scheme == "https":
+            # Tunnel through the proxy so TLS is still end to end
+            connection = HTTPSConnection(proxy_parts.hostname, proxy_parts.port, timeout=self.timeout)
+            connection.set_tunnel(host, port, self.get_proxy_headers(proxy))
+            return connection, False
+        return HTTPConnection(proxy_parts.hostname, proxy_parts.port, timeout=self.timeout), False
+
+    def release(self, key, connection):
+        with self.lock:
+            pool = self.idle.setdefault(key, [])
+            if len(pool) < self.max_idle:
+                pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for pool in self.idle.values():
+                for connection in pool:
+                    connection.close()
+            self.idle = {}
+
+    def request(self, url, headers=None, method="GET", redirects=HTTP_MAX_REDIRECTS):
+        """ Make a request, following redirects
+            Raises HTTPError for error responses and URLError if the server can't be reached """
+        from http.client import HTTPException
+        parts = urlsplit(url)
+        proxy = self.get_proxy(parts.scheme, parts.hostname)
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        if proxy is not None and parts.scheme == "http":
+            # A plain http proxy is sent the whole url instead of a tunnel
+            path = urlunsplit((parts.scheme, parts.netloc, path, "", ""))
+            headers = dict(headers or {}, **self.get_proxy_headers(proxy))
+
+        while True:
+            connection, reused = self.get_connection(key)
+            try:
+                connection.request(method, path, headers=headers or {})
+                response = connection.getresponse()
+                break
+            except (HTTPException, OSError) as exception:
+                connection.close()
+                # The server may have closed an idle connection, try again on a fresh one
+                if not reused:
+                    raise URLError(exception)
+
+        session_response = SessionResponse(self, key, connection, response, url)
+
+        if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+            location = urljoin(url, response.getheader("Location"))
+            session_response.close()
+            if response.status == 303:
+                method = "GET"
+            return self.request(location, headers, method, redirects - 1)
+
+        if response.status >= 400:
+            session_response.close()
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+
+        return session_response
+
+    def stats(self):
+        return "HTTP connections: {0} opened, {1} reused".format(self.opened, self.reused)
+
+
+SESSION = HTTPSession()
+
+
+class ResponseCache:
+    """ A persistent cache of API responses stored under ~/.giant_bomb_cli/cache,
+        keyed by the request url with the api key removed. Each endpoint has its
+        own time to live, after which entries are revalidated with the server """
+    def __init__(self, location=CACHE_LOCATION, max_size=CACHE_MAX_SIZE):
+        self.location = location
+        self.max_size = max_size
+        self.enabled = True
+        self.refresh = False
+
+    @staticmethod
+    def normalise_url(url):
+        " Strip the api key and put the query parameters in a stable order "
+        parts = urlsplit(url)
+        query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if key != "api_key")
+        return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+    @staticmethod
+    def get_ttl(url):
+        " How long a response from the url's endpoint may be served without revalidating "
+        endpoint = urlsplit(url).path.rstrip("/").split("/")[-1]
+        return CACHE_TTLS.get(endpoint, 0)
+
+    def path_for(self, url):
+        key = hashlib.sha1(self.normalise_url(url).encode("utf-8")).hexdigest()
+        return os.path.join(self.location, key + ".json")
+
+    def lookup(self, url):
+        " Returns the cached entry for url or None "
+        if not self.enabled:
+            return None
+        path = self.path_for(url)
+        try:
+            with open(path) as entry_file:
+                entry = json.load(entry_file)
+            # The modification time records when the entry was last used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def is_fresh(self, url, entry):
+        return not self.refresh and time.time() - entry["stored_at"] < self.get_ttl(url)
+
+    def store(self, url, body, etag=None, last_modified=None):
+        if not self.enabled:
+            return
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        self.write(url, dict(url=self.normalise_url(url), stored_at=time.time(), etag=etag,
+                             last_modified=last_modified, body=body))
+        self.evict()
+
+    def revalidated(self, url, entry):
+        " The server says our copy is still current, so restart its time to live "
+        entry["stored_at"] = time.time()
+        self.write(url, entry)
+
+    def write(self, url, entry):
+        if not os.path.exists(self.location):
+            os.makedirs(self.location, exist_ok=True)
+        path = self.path_for(url)
+        temp_path = "{0}.{1}.tmp".format(path, threading.get_ident())
+        try:
+            with open(temp_path, "w") as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(temp_path, path)
+        except OSError as exception:
+            gb_log(COLOURS["Error"], "Failed to write to the cache: " + str(exception))
+
+    def evict(self):
+        " Remove the least recently used entries until the cache fits in max_size "
+        entries = []
+        total_size = 0
+        try:
+            for name in os.listdir(self.location):
+                if name.endswith(".json"):
+                    path = os.path.join(self.location, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total_size += stat.st_size
+        except OSError:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+
+CACHE = ResponseCache()
+
+
+class RequestScheduler:
+    """ Every API request goes through the scheduler. A token bucket spaces the
+        requests out, each endpoint has an hourly budget that is remembered between
+        runs, and requests refused for going too fast or failing on the server are
+        retried with exponential backoff and jitter """
+    def __init__(self, rate=API_RATE, burst=API_BURST, hourly_budget=API_HOURLY_BUDGET):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.hourly_budget = hourly_budget
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # endpoint -> times of the requests made to it in the last hour
+        self.history = {}
+        self.retries = 0
+
+    @staticmethod
+    def get_endpoint(url):
+        return urlsplit(url).path.rstrip("/").split("/")[-1]
+
+    def load(self, path=QUOTA_LOCATION):
+        " Pick up the requests made by earlier runs in the last hour "
+        try:
+            with open(path) as quota_file:
+                history = json.load(quota_file)
+        except (OSError, ValueError):
+            return
+        cutoff = time.time() - 3600
+        with self.lock:
+            for endpoint, times in history.items():
+                self.history[endpoint] = deque(sorted(t for t in times if t > cutoff))
+
+    def save(self, path=QUOTA_LOCATION):
+        with self.lock:
+            history = {endpoint: list(times) for endpoint, times in self.history.items() if times}
+        try:
+            with open(path + ".tmp", "w") as quota_file:
+                json.dump(history, quota_file)
+            os.replace(path + ".tmp", path)
+        except OSError as exception:
+            gb_log(COLOURS["Error"], "Failed to save the request history: " + str(exception))
+
+    def acquire(self, endpoint):
+        " Block until a request to the endpoint is allowed "
+        warned = False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                wall_time = time.time()
+                history = self.history.setdefault(endpoint, deque())
+                while history and wall_time - history[0] >= 3600:
+                    history.popleft()
+
+                if self.hourly_budget > 0 and len(history) >= self.hourly_budget:
+                    wait = 3600 - (wall_time - history[0])
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    history.append(wall_time)
+                    return
+
+            if wait > 5 and not warned:
+                gb_log(COLOURS["Desc"], "Hourly request budget for {0} used up, waiting {1}".format(
+                    endpoint, convert_seconds_to_string(int(wait))))
+                warned = True
+            time.sleep(wait)
+
+    def backoff(self, attempt, retry_after=None):
+        " Wait before retrying, honouring the server's Retry-After if it sent one "
+        with self.lock:
+            self.retries += 1
+            # Whatever we were doing was too fast, so start again from an empty bucket
+            self.tokens = 0
+        if retry_after is not None and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = random.uniform(0, min(API_BACKOFF_MAX, API_BACKOFF * 2 ** attempt))
+        time.sleep(delay)
+
+    def request(self, url, headers=None):
+        """ Make an API request through the shared session and read its body, which
+            is retried too if it's cut short. Returns the closed response and the
+            decoded body. Raises HTTPError or URLError once the retries are used up """
+        from http.client import HTTPException
+        endpoint = self.get_endpoint(url)
+        for attempt in range(API_ATTEMPTS):
+            self.acquire(endpoint)
+            start = time.monotonic()
+            try:
+                with SESSION.request(url, headers) as response:
+                    body = response.read_decoded()
+                METRICS.record_request(endpoint, time.monotonic() - start, response.status)
+                return response, body
+            except HTTPError as exception:
+                METRICS.record_request(endpoint, time.monotonic() - start, exception.code)
+                if exception.code not in RETRY_STATUS_CODES or attempt + 1 == API_ATTEMPTS:
+                    raise
+                gb_log(COLOURS["Error"], "HTTPError = {0}, retrying".format(exception.code))
+                METRICS.record_retry(endpoint)
+                self.backoff(attempt, exception.headers.get("Retry-After"))
+            except URLError as exception:
+                METRICS.record_request(endpoint, time.monotonic() - start, None)
+                if attempt + 1 == API_ATTEMPTS:
+                    raise
+                gb_log(COLOURS["Error"], "URLError = {0}, retrying".format(exception.reason))
+                METRICS.record_retry(endpoint)
+                self.backoff(attempt)
+            except (HTTPException, OSError) as exception:
+                # The response was cut short or timed out while its body was read
+                METRICS.record_request(endpoint, time.monotonic() - start, None)
+                if attempt + 1 == API_ATTEMPTS:
+                    raise URLError(exception)
+                gb_log(COLOURS["Error"], "Reading the response failed ({0}), retrying".format(
+                    exception))
+                METRICS.record_retry(endpoint)
+                self.backoff(attempt)
+
+
+SCHEDULER = RequestScheduler()
+
+def gb_log(colour, string):
+    " Log a string with a specified colour "
+    CONSOLE.log(colour + string + COLOURS["End"])
 
 def convert_seconds_to_string(seconds):
     " Convert a time in seconds to a nicely formatted string "
-    mins = str(seconds/60)
+    mins = str(seconds//60)
     secs = str(seconds%60)
 
     # clean up instance of single digit second values
@@ -172,249 +1089,2098 @@ def create_filter_string_from_args(args):
             filter_string += "video_type:" + args.videoType + ","
         if args.showID != None:
             filter_string += "video_show:" + args.showID + ","
+        if args.startDate != None or args.endDate != None:
+            start, end = get_publish_date_range(args.startDate, args.endDate)
+            filter_string += "publish_date:" + quote(start + "|" + end) + ","
 
     return filter_string
 
-def create_request_url(args, api_key):
-    " Creates the initial request url "
-    request_url = "http://www.giantbomb.com/api"
+def get_publish_date_range(start_date, end_date):
+    " Turn the users YYYY-MM-DD dates into an inclusive range of publish dates "
+    start = EARLIEST_PUBLISH_DATE if start_date is None else start_date + " 00:00:00"
+    end = LATEST_PUBLISH_DATE if end_date is None else end_date + " 23:59:59"
+    return start, end
+
+def create_request_url(args, api_key, offset=None, limit=None):
+    " Creates the request url for a page of results, by default the first one "
+    request_url = API_URL
     request_url += "/videos/"
     request_url += "?api_key=" + api_key
     request_url += "&format=json"
-    request_url += "&limit=" + str(args.limit)
-    request_url += "&offset=" + str(args.offest)
+    request_url += "&limit=" + str(args.limit if limit is None else limit)
+    request_url += "&offset=" + str(args.offest if offset is None else offset)
     request_url += "&sort=id:" + args.sortOrder
     return request_url
 
-
-
-def retrieve_json_from_url(url, json_obj):
+def retrieve_page(url, description, use_cache=True):
+    """ Fetch a page of results, the scheduler has already retried it if it failed
+        Raises APIError if the page can't be retrieved """
+    json_obj = json.loads("{}")
+    if retrieve_json_from_url(url, json_obj, use_cache):
+        return json_obj
+
+    raise APIError("Failed to retrieve " + description + " from GB API")
+
+def iterate_videos(args, api_key):
+    """ Generates the videos matching the users arguments, requesting as many pages
+        as it takes to reach --limit. Each page is requested while the previous
+        one is still being worked through """
+    filter_string = create_filter_string_from_args(args)
+
+    def fetch_page(offset, limit):
+        request_url = create_request_url(args, api_key, offset, limit) + filter_string
+        if args.debugMode:
+            gb_log(COLOURS["Debug"], "Requesting url: " + request_url)
+        json_obj = retrieve_page(request_url, "videos (offset {0})".format(offset))
+        if args.debugMode:
+            gb_log(COLOURS["Debug"],
+                   "Received {0} of {1} possible results".format(json_obj["number_of_page_results"],
+                                                                 json_obj["number_of_total_results"]))
+            gb_log(COLOURS["Debug"], json.dumps(json_obj, sort_keys=True, indent=4))
+        return json_obj
+
+    remaining = args.limit
+    offset = args.offest
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(fetch_page, offset, min(remaining, API_PAGE_SIZE))
+        while next_page is not None:
+            json_obj = next_page.result()
+            results = json_obj["results"][:remaining]
+            remaining -= len(results)
+            offset += len(json_obj["results"])
+
+            next_page = None
+            if remaining > 0 and json_obj["results"] and offset < json_obj["number_of_total_results"]:
+                next_page = executor.submit(fetch_page, offset, min(remaining, API_PAGE_SIZE))
+
+            for video in results:
+                yield video
+
+def retrieve_json_from_url(url, json_obj, use_cache=True):
     """ Grabs the json file from the server, validates the error code
         If this function returns true then the json obj passed in has been
-        filled with valid data """
+        filled with valid data. Responses are served from the cache while fresh,
+        unless use_cache is False, which neither reads nor writes the cache """
+
+    entry = CACHE.lookup(url) if use_cache else None
+    if entry is not None and CACHE.is_fresh(url, entry):
+        METRICS.record_cache("hit")
+        json_obj.update(json.loads(entry["body"]))
+        return True
+
+    # Make the server request, asking only for changes if we have a stale copy
+    headers = {"Accept-Encoding": "gzip"}
+    if entry is not None:
+        if entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
 
-    # Make the server request
     response = None
     try:
-        response = urlopen(url).read()
+        server_response, body = SCHEDULER.request(url, headers)
+        if server_response.status == 304 and entry is not None:
+            METRICS.record_cache("revalidated")
+            CACHE.revalidated(url, entry)
+            json_obj.update(json.loads(entry["body"]))
+            return True
+        if CACHE.enabled and use_cache:
+            METRICS.record_cache("miss")
+        response = body
+        METRICS.record_response_bytes(SCHEDULER.get_endpoint(url), len(response))
+        etag = server_response.headers.get("ETag")
+        last_modified = server_response.headers.get("Last-Modified")
     except HTTPError as exception:
         gb_log(COLOURS["Error"], "HTTPError = " + str(exception.code))
     except URLError as exception:
         gb_log(COLOURS["Error"], "URLError = " + str(exception.reason))
 
     if response != None:
-        json_file = json.loads(response)
+        try:
+            json_file = json.loads(response)
+        except ValueError as exception:
+            gb_log(COLOURS["Error"], "Invalid response from server: " + str(exception))
+            return False
 
         if "status_code" in json_file:
             error = get_status_code_as_string(json_file["status_code"])
             if error == "OK":
                 json_obj.update(json_file)
+                if use_cache:
+                    CACHE.store(url, response, etag, last_modified)
                 return True
-        else:
             gb_log(COLOURS["Error"], "Error occured: " + error)
 
     return False
 
-def dump_video_types(api_key):
-    " Print out the list of video types "
-    gb_log(COLOURS["Title"], "Dumping video type IDs")
-    types_url = "http://www.giantbomb.com/api/video_types/?api_key={0}&format=json".format(
-        api_key)
+def get_video_types(api_key):
+    """ The list of video types
+        Raises APIError if it can't be retrieved """
+    types_url = "{0}/video_types/?api_key={1}&format=json".format(API_URL, api_key)
     json_obj = json.loads("{}")
 
     if retrieve_json_from_url(types_url, json_obj) is False:
-        gb_log(COLOURS["Error"], "Failed to retrieve video types from GB API")
+        raise APIError("Failed to retrieve video types from GB API")
+    return json_obj["results"]
+
+def get_video_shows(api_key):
+    """ The list of video shows, each with its latest episode
+        Raises APIError if it can't be retrieved """
+    shows_url = "{0}/video_shows/?api_key={1}&format=json".format(API_URL, api_key)
+    json_obj = json.loads("{}")
+
+    if retrieve_json_from_url(shows_url, json_obj) is False:
+        raise APIError("Failed to retrieve shows from GB API")
+    return json_obj["results"]
+
+def dump_video_types(api_key):
+    " Print out the list of video types "
+    gb_log(COLOURS["Title"], "Dumping video type IDs")
+    try:
+        video_types = get_video_types(api_key)
+    except APIError as exception:
+        gb_log(COLOURS["Error"], str(exception))
         return 1
 
-    for video_type in json_obj["results"]:
+    for video_type in video_types:
         gb_log(COLOURS["Desc"],
                "\t {0}: {1} - ({2})".format(video_type["id"],
                                             video_type["name"], video_type["deck"]))
+    return 0
 
 def dump_video_shows(api_key):
     " Print out the list of video shows "
     gb_log(COLOURS["Title"], "Dumping video show IDs")
-    shows_url = "http://www.giantbomb.com/api/video_shows/?api_key={0}&format=json".format(
-        api_key)
-    json_obj = json.loads("{}")
-
-    if retrieve_json_from_url(shows_url, json_obj) is False:
-        gb_log(COLOURS["Error"], "Failed to retrieve shows from GB API")
+    try:
+        video_shows = get_video_shows(api_key)
+    except APIError as exception:
+        gb_log(COLOURS["Error"], str(exception))
         return 1
-    shows = Shows()
-    for video_show in json_obj["results"]:
-        latest_episode = video_show["latest"][0]
-        show = Show(ShowInfo(str(video_show["id"]), [EpisodeInfo(latest_episode["name"], latest_episode["id"],latest_episode["publish_date"],None,None,None)], None))
-        shows.shows.append(show)
+
+    for video_show in video_shows:
         gb_log(COLOURS["Desc"],
                "\t {0}: {1} - ({2})".format(video_show["id"],
                                             video_show["title"], video_show["deck"], ))
+    return 0
 
-    return shows
 
+def load_subscriptions():
+    " Open the subscription store, importing shows.json if it's still around "
+    store = SubscriptionStore()
+    store.migrate_json()
+    return store
 
-def download_subscriptions(api_key,args):
+def download_subscriptions(api_key, quality="high", jobs=1, segments=1, queue_path=None,
+                           settings=None):
+    """ Download every new episode of the subscribed shows, or with queue_path add
+        them to that work queue for --worker processes to download
+        Returns the number of downloads that failed """
     # Get Subscriptions Data
-    shows = Shows()
-    try:
-        with open('shows.json') as j:
-            shows = Shows().fromJson(j.read())
-    except:
-        shows = Shows()
+    store = load_subscriptions()
 
-    if not len(shows.shows) > 0:
+    if not len(store.show_ids()) > 0:
         gb_log(COLOURS["Error"], "No Shows subscrbed to, see --subscribe_to_show_id")
         return 1
 
-    currentShows = dump_video_shows(api_key)
-
-    for show in currentShows.shows:
-        v = shows.contains_show_id(show.show.show_id)
-        if v != False:
-            if v.show.get_latest_date() < show.get_latest_date():
-                get_new_episodes(api_key, v)
-                save_show_data(shows)
-            
-            for episode in v.show.episodes:
-                if not episode.downloaded_or_skiped:
-                    prepare_and_download(episode.high_url, episode.video_name, v.show.download_folder)
-                    episode.downloaded_or_skiped = True
-                    save_show_data(shows)
-
-def save_show_data(shows):
-    with open('shows.json', 'w') as outfile:  
-        json.dump(shows.reprJSON(), outfile, cls=ComplexEncoder )
-
-def get_new_episodes(api_key, show:Show):
-    show_data = Show(ShowInfo(show.show.show_id,get_episode_data(api_key, show.show.show_id, False), None))
-    latest_synce_date = show.get_latest_date()
-    
-    for episode in show_data.show.episodes:
-        if episode.publish_date > latest_synce_date:
-            episode.downloaded_or_skiped = False
-            show.show.episodes.append(episode)
-    
+    if queue_path is not None:
+        with METRICS.phase("subscription_sync"):
+            fill_work_queue(api_key, store, WorkQueue(queue_path), quality)
+        return 0
+
+    scheduler = DownloadScheduler(api_key, jobs, segments, settings)
+    with METRICS.phase("subscription_sync"):
+        queue_subscription_downloads(api_key, store, scheduler, quality)
+
+    with METRICS.phase("subscription_downloads"):
+        return scheduler.wait()
+
+def queue_subscription_downloads(api_key, store, scheduler, quality="high"):
+    """ Check each subscribed show for new episodes and queue everything not yet
+        downloaded, in the best quality available up to the one asked for """
+    get_new_episodes(api_key, store, store.show_ids())
+
+    for show_id, episode, url, download_folder in get_pending_downloads(api_key, store, quality):
+        scheduler.submit(url, episode.video_name, download_folder,
+                         lambda show_id=show_id, video_id=episode.video_id:
+                         store.mark_downloaded(show_id, video_id), episode.video_id)
+
+def get_pending_downloads(api_key, store, quality="high", show_ids=None):
+    """ Generates (show id, episode, url, download folder) for every episode of the
+        shows, all of the subscribed ones by default, not yet downloaded that's
+        available in some quality """
+    for show_id in show_ids if show_ids is not None else store.show_ids():
+        download_folder = store.get_download_folder(show_id)
+        episodes = [(episode, PROBE.start(get_episode_urls(episode), api_key))
+                    for episode in store.get_episodes(show_id, pending_only=True)]
+        for episode, probes in episodes:
+            url = choose_video_url(get_episode_urls(episode), probes, quality, episode.video_name)[0]
+            if url is not None:
+                yield show_id, episode, url, download_folder
+
+def watch_subscriptions(api_key, quality="high", jobs=1, segments=1, settings=None):
+    """ Keep checking the subscribed shows for new episodes, until interrupted, and
+        download each one as soon as it's found. Every show is checked on its own
+        schedule, worked out from how often it publishes
+        Returns the number of downloads that failed """
+    store = load_subscriptions()
+    scheduler = DownloadScheduler(api_key, jobs, segments, settings)
+    next_checks = {}
+    # Episodes being downloaded, so checks made meanwhile don't queue them again
+    downloading = set()
+
+    gb_log(COLOURS["Title"], "Watching {0} shows for new episodes, press Ctrl-C to stop".format(
+        len(store.show_ids())))
+    try:
+        while True:
+            now = time.time()
+            show_ids = store.show_ids()
+            for show_id in show_ids:
+                # New subscriptions are checked straight away
+                next_checks.setdefault(show_id, now)
+            due = [show_id for show_id in show_ids if next_checks[show_id] <= now]
+
+            if due:
+                with METRICS.phase("subscription_sync"):
+                    get_new_episodes(api_key, store, due)
+                for show_id, episode, url, download_folder in get_pending_downloads(api_key, store,
+                                                                                  quality, due):
+                    key = (show_id, episode.video_id)
+                    if key in downloading:
+                        continue
+                    downloading.add(key)
+                    future = scheduler.submit(url, episode.video_name, download_folder,
+                                              lambda key=key: store.mark_downloaded(*key),
+                                              episode.video_id)
+                    future.add_done_callback(lambda future, key=key: downloading.discard(key))
+
+                for show_id in due:
+                    history = store.get_publish_history(show_id, WATCH_HISTORY)
+                    next_checks[show_id] = time.time() + get_check_interval(history, time.time())
+                gb_log(COLOURS["Desc"], "Checked {0} shows, the next check is in {1:.1f} hours".format(
+                    len(due), (min(next_checks[show_id] for show_id in show_ids) - time.time()) / 3600.0))
+                # Keep the request quota up to date for anything else using the api
+                SCHEDULER.save()
+                PROBE.save()
+
+            if show_ids:
+                wait = min(next_checks[show_id] for show_id in show_ids) - time.time()
+            else:
+                wait = WATCH_RESCAN
+            time.sleep(min(max(wait, 1), WATCH_RESCAN))
+    except KeyboardInterrupt:
+        gb_log(COLOURS["Title"], "Stopped watching, waiting for the downloads in progress")
+
+    with METRICS.phase("subscription_downloads"):
+        return scheduler.wait()
+
+def get_check_interval(history, now):
+    """ Seconds until a show should be checked for new episodes again, from the
+        publish dates of its recent episodes, newest first. A show is checked most
+        often once its next episode is due, and less the longer it's been quiet """
+    if not history:
+        return WATCH_MAX_INTERVAL
+    times = [get_publish_time(published) for published in history]
+    gaps = sorted(newer - older for newer, older in zip(times, times[1:]) if newer > older)
+    gap = gaps[len(gaps) // 2] if gaps else WATCH_DEFAULT_GAP
+    since = now - times[0]
+
+    if since > gap * 3:
+        # Gone quiet, back off as the silence goes on
+        interval = since / 8
+    elif since >= gap * 0.75:
+        # The next episode is due
+        interval = min(gap / 48, WATCH_DUE_INTERVAL)
+    else:
+        # Nothing until the next episode is nearly due
+        interval = gap * 0.75 - since
+    return min(max(interval, WATCH_MIN_INTERVAL), WATCH_MAX_INTERVAL)
+
+def fill_work_queue(api_key, store, queue, quality="high"):
+    """ Record the downloads workers have finished in the store, then check for new
+        episodes and put everything still to be downloaded into the queue """
+    for show_id, video_id in queue.completed():
+        store.mark_downloaded(show_id, video_id)
+    get_new_episodes(api_key, store, store.show_ids())
+
+    added = queue.add((show_id, episode.video_id, episode.video_name, url, download_folder)
+                      for show_id, episode, url, download_folder
+                      in get_pending_downloads(api_key, store, quality))
+    counts = queue.counts()
+    gb_log(COLOURS["Title"], "Queued {0} episodes, {1} waiting and {2} being downloaded".format(
+        added, counts.get("pending", 0), counts.get("leased", 0)))
+    queue.close()
+
+
+class WorkQueue:
+    """ Downloads shared between worker processes, which can be on different machines,
+        through an SQLite database on a shared drive. A worker leases an item while it
+        downloads it and keeps renewing the lease, so the items of a worker that dies
+        are handed to another once its leases run out. Output folders are kept
+        relative to the queue, so machines can mount the drive in different places """
+    def __init__(self, path):
+        self.path = path
+        self.base = os.path.dirname(os.path.abspath(path))
+        self.lock = threading.RLock()
+        import sqlite3
+        # Transactions are begun by hand, so claims can lock the database up front
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                          check_same_thread=False)
+        # WAL needs memory shared between the processes, which network drives can't do
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        with self.transaction():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS items ("
+                                    "show_id TEXT NOT NULL, video_id INTEGER NOT NULL, "
+                                    "name TEXT NOT NULL, url TEXT NOT NULL, folder TEXT, "
+                                    "state TEXT NOT NULL DEFAULT 'pending', owner TEXT, "
+                                    "lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                                    "queued REAL, PRIMARY KEY (show_id, video_id))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS items_by_state "
+                                    "ON items (state, queued)")
+
+    @contextmanager
+    def transaction(self):
+        " Hold the database's write lock for the body, committing if it succeeds "
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def add(self, items):
+        """ Queue (show id, video id, name, url, folder) items, those already queued are
+            left alone unless they failed, in which case they're tried again
+            Returns the number of items added or retried """
+        # Read a generator of items before taking the lock
+        now = time.time()
+        rows = [(show_id, video_id, name, url, self.relative_folder(folder), now)
+                for show_id, video_id, name, url, folder in items]
+        with self.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT INTO items (show_id, video_id, name, url, folder, queued) "
+                                   "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (show_id, video_id) "
+                                   "DO UPDATE SET state = 'pending', attempts = 0, url = excluded.url "
+                                   "WHERE state = 'failed'", rows)
+            return connection.total_changes - before
+
+    def claim(self, owner):
+        """ Lease the oldest waiting item to owner, or one whose lease has run out
+            Returns (show id, video id, name, url, folder), or None if there's nothing to do """
+        now = time.time()
+        with self.transaction() as connection:
+            # Items whose workers keep dying on them are given up on
+            connection.execute("UPDATE items SET state = 'failed', owner = NULL "
+                               "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                               (now, QUEUE_ATTEMPTS))
+            row = connection.execute("SELECT show_id, video_id, name, url, folder FROM items "
+                                     "WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                                     "ORDER BY queued, video_id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE items SET state = 'leased', owner = ?, lease_expires = ?, "
+                               "attempts = attempts + 1 WHERE show_id = ? AND video_id = ?",
+                               (owner, now + QUEUE_LEASE, row[0], row[1]))
+        return row[:4] + (self.resolve_folder(row[4]),)
+
+    def heartbeat(self, owner):
+        " Renew the leases of every item owner holds, returns how many it holds "
+        with self.transaction() as connection:
+            return connection.execute("UPDATE items SET lease_expires = ? "
+                                      "WHERE owner = ? AND state = 'leased'",
+                                      (time.time() + QUEUE_LEASE, owner)).rowcount
+
+    def complete(self, show_id, video_id, owner):
+        """ Mark an item downloaded
+            Returns False if owner had lost its lease on it """
+        with self.transaction() as connection:
+            return connection.execute("UPDATE items SET state = 'done', owner = NULL, "
+                                      "lease_expires = NULL WHERE show_id = ? AND video_id = ? "
+                                      "AND owner = ?", (show_id, video_id, owner)).rowcount == 1
+
+    def fail(self, show_id, video_id, owner):
+        " Put an item back in the queue, unless it's been tried QUEUE_ATTEMPTS times "
+        with self.transaction() as connection:
+            connection.execute("UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' "
+                               "ELSE 'pending' END, owner = NULL, lease_expires = NULL "
+                               "WHERE show_id = ? AND video_id = ? AND owner = ?",
+                               (QUEUE_ATTEMPTS, show_id, video_id, owner))
+
+    def release(self, owner):
+        " Hand back every item owner holds, without counting it as an attempt "
+        with self.transaction() as connection:
+            connection.execute("UPDATE items SET state = 'pending', owner = NULL, lease_expires = NULL, "
+                               "attempts = attempts - 1 WHERE owner = ? AND state = 'leased'", (owner,))
+
+    def completed(self):
+        " The (show id, video id) of every item that's been downloaded "
+        with self.lock:
+            return self.connection.execute("SELECT show_id, video_id FROM items "
+                                           "WHERE state = 'done'").fetchall()
+
+    def counts(self):
+        " How many items are in each state "
+        with self.lock:
+            return dict(self.connection.execute("SELECT state, count(*) FROM items GROUP BY state"))
+
+    def relative_folder(self, folder):
+        folder = os.path.abspath(folder or ".")
+        try:
+            if os.path.commonpath([folder, self.base]) == self.base:
+                return os.path.relpath(folder, self.base)
+        except ValueError:
+            # On another drive
+            pass
+        return folder
+
+    def resolve_folder(self, folder):
+        return os.path.normpath(os.path.join(self.base, folder))
+
+
+def run_queue_worker(api_key, queue_path, jobs=1, segments=1, settings=None):
+    """ Download items from a shared work queue, jobs at a time, until there are none
+        left waiting or being downloaded by other workers
+        Returns the number of downloads that failed """
+    import socket
+    from concurrent.futures import ThreadPoolExecutor
+    queue = WorkQueue(queue_path)
+    owner = "{0}:{1}".format(socket.gethostname(), os.getpid())
+    progress = DownloadProgress()
+    # Set to stop claiming new items, and once the downloads in progress are over
+    stopping = threading.Event()
+    finished = threading.Event()
+    results = dict(succeeded=0, failed=0)
+
+    def renew_leases():
+        while not finished.wait(QUEUE_HEARTBEAT):
+            try:
+                queue.heartbeat(owner)
+            except Exception as exception:
+                gb_log(COLOURS["Error"], "Couldn't renew leases: " + str(exception))
+
+    def work():
+        while not stopping.is_set():
+            item = queue.claim(owner)
+            if item is None:
+                counts = queue.counts()
+                if counts.get("pending", 0) + counts.get("leased", 0) == 0:
+                    return
+                # Wait for other workers to finish, or for their leases to run out
+                stopping.wait(QUEUE_POLL)
+                continue
+
+            show_id, video_id, name, url, folder = item
+            progress.add_file()
+            try:
+                success = prepare_and_download(api_key, url, name, folder, progress, segments,
+                                               video_id, settings)
+            except Exception as exception:
+                gb_log(COLOURS["Error"], "Download of " + name + " failed: " + str(exception))
+                success = False
+
+            if not success:
+                queue.fail(show_id, video_id, owner)
+            elif not queue.complete(show_id, video_id, owner):
+                gb_log(COLOURS["Error"], "Lost the lease on " + name + " while downloading it")
+            with progress.lock:
+                results["succeeded" if success else "failed"] += 1
+
+    gb_log(COLOURS["Title"], "Working on " + queue_path + " as " + owner)
+    threading.Thread(target=renew_leases, daemon=True).start()
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        with METRICS.phase("queue_downloads"):
+            futures = [executor.submit(work) for _ in range(max(1, jobs))]
+            for future in futures:
+                future.result()
+    except KeyboardInterrupt:
+        gb_log(COLOURS["Error"], "Interrupted, finishing the downloads in progress")
+        raise
+    finally:
+        # Leases are only handed back once nothing is using them, if this is
+        # interrupted again they run out instead
+        stopping.set()
+        executor.shutdown(wait=True)
+        finished.set()
+        queue.release(owner)
+        queue.close()
+        CONSOLE.clear_status()
+
+    gb_log(COLOURS["Title"], "Downloaded {0} of {1} videos".format(
+        results["succeeded"], results["succeeded"] + results["failed"]))
+    return results["failed"]
+
+def get_new_episodes(api_key, store, show_ids):
+    """ Add the episodes published since each show's watermark to the store. Shows
+        are asked about in batches of up to SUBSCRIPTION_BATCH_SIZE whose watermarks
+        are within SUBSCRIPTION_BATCH_WINDOW of each other, with one query per batch
+        that starts from the batch's oldest watermark. Episodes the store already
+        has come back too but are ignored """
+    for batch, since in get_subscription_batches(store, show_ids):
+        try:
+            episodes = get_batch_episode_data(api_key, batch, since)
+        except APIError as exception:
+            gb_log(COLOURS["Error"], str(exception))
+            continue
+        for show_id in batch:
+            store.add_episodes(show_id, episodes[show_id])
+
+def get_subscription_batches(store, show_ids):
+    " Generates (show ids, watermark to query from) for each batch of get_new_episodes "
+    watermarks = dict((show_id, store.get_watermark(show_id)[0]) for show_id in show_ids)
+    # Shows without any episodes yet need their whole history, so they're kept apart
+    new_shows = [show_id for show_id in show_ids if watermarks[show_id] is None]
+    for start in range(0, len(new_shows), SUBSCRIPTION_BATCH_SIZE):
+        yield new_shows[start:start + SUBSCRIPTION_BATCH_SIZE], None
+
+    batch = []
+    batch_start = None
+    for show_id in sorted((show_id for show_id in show_ids if watermarks[show_id] is not None),
+                          key=watermarks.get):
+        watermark = get_publish_time(parse_publish_date(watermarks[show_id]))
+        if batch and (len(batch) == SUBSCRIPTION_BATCH_SIZE
+                      or watermark - batch_start > SUBSCRIPTION_BATCH_WINDOW):
+            yield batch, watermarks[batch[0]]
+            batch = []
+        if not batch:
+            batch_start = watermark
+        batch.append(show_id)
+    if batch:
+        yield batch, watermarks[batch[0]]
+
+def get_batch_episode_data(api_key, show_ids, since=None):
+    """ The episodes of several shows published on or after since, fetched with
+        queries that OR the show ids together
+        Returns a dict of show id -> list of episodes in publish order
+        Raises APIError if a page can't be retrieved """
+    episodes = dict((show_id, []) for show_id in show_ids)
+    pages = retrieve_all_pages(lambda offset: get_episode_url(api_key, show_ids, offset, since),
+                               "episodes (shows {0})".format(", ".join(show_ids)))
+    for page in pages:
+        for video in page["results"]:
+            show_id = str((video.get("video_show") or {}).get("id"))
+            if show_id in episodes:
+                episodes[show_id].append(EpisodeInfo(video["name"], video["id"], video["publish_date"],
+                                                     video["hd_url"], video["high_url"],
+                                                     video["low_url"], False))
+    return episodes
 
-def subscribe(api_key, args):
-    if args.outputFolder == None:
+def subscribe(api_key, show_id, output_folder, skip_old=True):
+    " Subscribe to a show, marking the episodes already out as downloaded unless skip_old is False "
+    if output_folder == None:
         gb_log(COLOURS["Error"], "Must Specify Output Directory for show")
         return 1        
 
-    show_id = args.subscribe
     # Get the subscriptions that we already have
-    try:
-        with open('shows.json') as j:
-            shows = Shows().fromJson(j.read())
-    except:
-        shows = Shows()
+    store = load_subscriptions()
 
     # Check if we already have the show
-    if shows.contains_show_id(show_id) != False:
-        return
+    if store.contains_show_id(show_id):
+        return 0
 
     # Get show and episode
-    show = Show(ShowInfo(show_id,get_episode_data(api_key,show_id,skipped=args.dont_skip_old),args.outputFolder ))
-    shows.shows.append(show)
-
-    # Write updated file back to shows list
-    save_show_data(shows)
-
-    
-def get_episode_data(api_key,show_id, offset=0, skipped=True):
-    shows_url = "https://www.giantbomb.com/api/videos/?api_key={0}&filter=video_show:{1}&format=json&sort=publish_date:asc&sort=publish_date:asc&offset={2}".format(api_key,show_id,offset)
-    json_obj = json.loads("{}")
-    
-    if retrieve_json_from_url(shows_url, json_obj) is False:
-        gb_log(COLOURS["Error"], "Failed to retrieve episodes from GB API")
+    try:
+        show = ShowInfo(show_id, get_episode_data(api_key, show_id, skipped=skip_old), output_folder)
+    except APIError as exception:
+        gb_log(COLOURS["Error"], str(exception))
         return 1
 
-    episodes = []
-    for video_show in json_obj["results"]:
-        episodes.append(EpisodeInfo(video_show["name"], video_show["id"],video_show["publish_date"],video_show["hd_url"],video_show["high_url"],video_show["low_url"] ,skipped))
+    # Add the show and its episodes to the store
+    store.add_show(show)
+    return 0
+
+class VideoCatalog:
+    """ A local mirror of the /videos/ metadata in ~/.giant_bomb_cli/catalog.db,
+        with a full text index over video names, so searches can be answered
+        without going to the API. The records are kept exactly as the API sent them """
+    def __init__(self, path=CATALOG_LOCATION):
+        self.lock = threading.RLock()
+        import sqlite3
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS videos ("
+                                    "id INTEGER PRIMARY KEY, name TEXT, deck TEXT, "
+                                    "video_types TEXT, video_show_id INTEGER, publish_date TEXT, "
+                                    "record TEXT NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS videos_by_show "
+                                    "ON videos (video_show_id, publish_date)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS videos_by_publish_date "
+                                    "ON videos (publish_date)")
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5("
+                                    "name, deck, content='videos', content_rowid='id')")
+            # Keep the full text index in step with the videos table
+            self.connection.execute("CREATE TRIGGER IF NOT EXISTS videos_fts_insert AFTER INSERT ON videos "
+                                    "BEGIN INSERT INTO videos_fts (rowid, name, deck) "
+                                    "VALUES (new.id, new.name, new.deck); END")
+            self.connection.execute("CREATE TRIGGER IF NOT EXISTS videos_fts_delete AFTER DELETE ON videos "
+                                    "BEGIN INSERT INTO videos_fts (videos_fts, rowid, name, deck) "
+                                    "VALUES ('delete', old.id, old.name, old.deck); END")
+            self.connection.execute("CREATE TRIGGER IF NOT EXISTS videos_fts_update AFTER UPDATE ON videos "
+                                    "BEGIN INSERT INTO videos_fts (videos_fts, rowid, name, deck) "
+                                    "VALUES ('delete', old.id, old.name, old.deck); "
+                                    "INSERT INTO videos_fts (rowid, name, deck) "
+                                    "VALUES (new.id, new.name, new.deck); END")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def latest_id(self):
+        " The id of the newest video in the catalog, None if it's empty "
+        with self.lock:
+            return self.connection.execute("SELECT MAX(id) FROM videos").fetchone()[0]
+
+    def add_videos(self, videos):
+        " Add or update videos in one transaction, returns how many there were "
+        rows = []
+        for video in videos:
+            video_types = [str(category["id"]) for category in video.get("video_categories") or []]
+            rows.append((video["id"], video["name"], video["deck"], "," + ",".join(video_types) + ",",
+                         (video.get("video_show") or {}).get("id"), video["publish_date"],
+                         json.dumps(video)))
+
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO videos (id, name, deck, video_types, video_show_id, "
+                                        "publish_date, record) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                                        "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+                                        "deck = excluded.deck, video_types = excluded.video_types, "
+                                        "video_show_id = excluded.video_show_id, "
+                                        "publish_date = excluded.publish_date, record = excluded.record",
+                                        rows)
+        return len(rows)
+
+    @staticmethod
+    def get_name_query(name):
+        " Match every word of name against video names, each as a prefix "
+        words = re.findall(r"\w+", name)
+        return "name : (" + " ".join('"' + word + '"*' for word in words) + ")" if words else None
+
+    def search(self, name=None, video_id=None, video_type=None, show_id=None, start_date=None,
+               end_date=None, sort_order="desc", limit=25, offset=0):
+        " Generates the records matching the filters, which work like the API's "
+        conditions = []
+        params = []
+        if name is not None:
+            name_query = self.get_name_query(name)
+            if name_query is not None:
+                conditions.append("id IN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ?)")
+                params.append(name_query)
+        if video_id is not None:
+            conditions.append("id = ?")
+            params.append(int(video_id))
+        if video_type is not None:
+            conditions.append("video_types LIKE ?")
+            params.append("%," + str(video_type) + ",%")
+        if show_id is not None:
+            conditions.append("video_show_id = ?")
+            params.append(int(show_id))
+        if start_date is not None or end_date is not None:
+            start, end = get_publish_date_range(start_date, end_date)
+            conditions.append("publish_date BETWEEN ? AND ?")
+            params.extend([start, end])
+
+        query = "SELECT record FROM videos"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY id " + ("ASC" if sort_order == "asc" else "DESC") + " LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+            rows = cursor.fetchmany(CATALOG_FETCH_SIZE)
+        while rows:
+            for (record,) in rows:
+                yield json.loads(record)
+            with self.lock:
+                rows = cursor.fetchmany(CATALOG_FETCH_SIZE)
+
+
+def retrieve_all_pages(make_url, description, jobs=PAGE_JOBS, use_cache=True):
+    """ Generates every page of a request in order. The first page gives the total
+        number of results, the remaining pages are then fetched concurrently
+        Raises APIError if a page can't be retrieved """
+    first_page = retrieve_page(make_url(0), description + " (offset 0)", use_cache)
+    offsets = range(API_PAGE_SIZE, first_page["number_of_total_results"], API_PAGE_SIZE)
+
+    def fetch(offset):
+        return retrieve_page(make_url(offset), "{0} (offset {1})".format(description, offset),
+                             use_cache)
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # map hands the pages back in offset order whichever finishes first
+        for page in chain([first_page], executor.map(fetch, offsets)):
+            yield page
+
+def get_episode_url(api_key, show_ids, offset, since=None):
+    """ The url of a page of the episodes of one or more shows, optionally only
+        those published on or after since """
+    episode_filter = "video_show:" + "|".join(str(show_id) for show_id in show_ids)
+    if since is not None:
+        episode_filter += ",publish_date:" + quote(since + "|" + LATEST_PUBLISH_DATE)
+    return "{0}/videos/?api_key={1}&filter={2}&format=json&sort=publish_date:asc&limit={3}&offset={4}".format(API_URL, api_key, episode_filter, API_PAGE_SIZE, offset)
+
+def get_episode_data(api_key, show_id, skipped=True, since=None, jobs=PAGE_JOBS):
+    """ Generates the episodes of a show in publish order
+        Raises APIError if a page can't be retrieved """
+    pages = retrieve_all_pages(lambda offset: get_episode_url(api_key, [show_id], offset, since),
+                               "episodes (show {0})".format(show_id), jobs)
+    for page in pages:
+        for video in page["results"]:
+            yield EpisodeInfo(video["name"], video["id"], video["publish_date"], video["hd_url"],
+                              video["high_url"], video["low_url"], skipped)
+
+def get_catalog_url(api_key, offset, sort_order):
+    return "{0}/videos/?api_key={1}&format=json&sort=id:{2}&limit={3}&offset={4}".format(API_URL, api_key, sort_order, API_PAGE_SIZE, offset)
+
+def sync_catalog(api_key):
+    """ Mirror the metadata of every video into the local catalog. The first sync
+        pages through everything concurrently, later ones only fetch the videos
+        newer than the newest one we have. The response cache isn't used, so a
+        sync always sees the latest videos and doesn't push everything else out """
+    catalog = VideoCatalog()
+    latest_id = catalog.latest_id()
+    added = 0
 
-    if json_obj["number_of_page_results"] == 100:
-        episodes.extend(get_episode_data(api_key,show_id, offset+100, skipped))
-    return episodes
+    try:
+        if latest_id is None:
+            gb_log(COLOURS["Title"], "Building the local catalog, this can take a while")
+            pages = retrieve_all_pages(lambda offset: get_catalog_url(api_key, offset, "asc"), "catalog",
+                                       use_cache=False)
+            for page in pages:
+                added += catalog.add_videos(page["results"])
+                CONSOLE.set_status("{0} videos".format(added))
+        else:
+            offset = 0
+            while True:
+                page = retrieve_page(get_catalog_url(api_key, offset, "desc"),
+                                     "catalog (offset {0})".format(offset), use_cache=False)
+                new_videos = [video for video in page["results"] if video["id"] > latest_id]
+                added += catalog.add_videos(new_videos)
+                offset += len(page["results"])
+                if len(new_videos) < len(page["results"]) or not page["results"] \
+                        or offset >= page["number_of_total_results"]:
+                    break
+    except APIError as exception:
+        gb_log(COLOURS["Error"], str(exception))
+        return 1
+    finally:
+        CONSOLE.clear_status()
+        catalog.close()
+
+    gb_log(COLOURS["Title"], "Added {0} videos to the local catalog".format(added))
+    return 0
+
+def read_batch_file(path, defaults=None):
+    """ Read the searches in a --batch file, - for stdin. Each line is a JSON object
+        of GiantBombClient.videos' arguments, any not given are taken from the dict
+        defaults. Blank lines and lines starting with # are skipped
+        Returns a list of VideoQuery
+        Raises ValueError if a line isn't a valid search """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path) as batch_file:
+            lines = batch_file.read().splitlines()
+
+    queries = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            search = json.loads(line)
+            if not isinstance(search, dict):
+                raise ValueError("each search is written as a JSON object")
+            query = VideoQuery(**dict(defaults or {}, **search))
+        except (ValueError, TypeError) as exception:
+            raise ValueError("line {0} of {1}: {2}".format(number, path, exception))
+        if query.sortOrder not in ("asc", "desc"):
+            raise ValueError("line {0} of {1}: sort must be asc or desc".format(number, path))
+        for date in (query.startDate, query.endDate):
+            if date is not None:
+                try:
+                    time.strptime(date, "%Y-%m-%d")
+                except ValueError:
+                    raise ValueError("line {0} of {1}: dates are written YYYY-MM-DD".format(number, path))
+        queries.append(query)
+    return queries
+
+def iterate_batch(queries, search, jobs=BATCH_JOBS):
+    """ Generates the videos found by several queries, running search on jobs of them
+        at a time. Videos come out in the order of the queries that found them, each
+        one only once. A query that fails is skipped
+        Raises APIError after the rest are done if any failed """
+    def run(query):
+        return list(search(query))
+
+    from concurrent.futures import ThreadPoolExecutor
+    seen = set()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(run, query) for query in queries]
+        for number, future in enumerate(futures, 1):
+            try:
+                videos = future.result()
+            except APIError as exception:
+                gb_log(COLOURS["Error"], "Search {0} failed: {1}".format(number, exception))
+                failed += 1
+                continue
+            for video in videos:
+                if video["id"] not in seen:
+                    seen.add(video["id"])
+                    yield video
+
+    if failed > 0:
+        raise APIError("{0} of {1} searches failed".format(failed, len(queries)))
+
+def iterate_local_videos(args):
+    " Generates the videos matching the users arguments from the local catalog "
+    catalog = VideoCatalog()
+    try:
+        if catalog.latest_id() is None:
+            gb_log(COLOURS["Error"], "The local catalog is empty, see --sync-catalog")
+            return
+
+        filters = {}
+        if args.shouldFilter:
+            filters = dict(name=args.filterName, video_id=args.contentID, video_type=args.videoType,
+                           show_id=args.showID, start_date=args.startDate, end_date=args.endDate)
+        for video in catalog.search(sort_order=args.sortOrder, limit=args.limit,
+                                    offset=args.offest, **filters):
+            yield video
+    finally:
+        catalog.close()
 
 def validate_args(opts):
     " Validate the users arguments "
 
     # Validate filters
     if opts.shouldFilter is False:
-        if opts.filterName != None or opts.contentID != None or opts.videoType != None:
+        if opts.filterName != None or opts.contentID != None or opts.videoType != None \
+                or opts.startDate != None or opts.endDate != None:
             gb_log(COLOURS["Error"], "Please use --filter command to process filter arguments")
             return False
 
+    for date in (opts.startDate, opts.endDate):
+        if date != None:
+            try:
+                time.strptime(date, "%Y-%m-%d")
+            except ValueError:
+                gb_log(COLOURS["Error"], "Invalid date '" + date + "', dates are written YYYY-MM-DD")
+                return False
+
     if opts.quality != None:
         if opts.quality not in VIDEO_QUALITIES:
-            gb_log(COLOURS["Error"], "Invalid quality value, options are 'low', 'high', 'hd'")
+            gb_log(COLOURS["Error"], "Invalid quality value, options are 'low', 'high', 'hd', 'best'")
             return False
 
     if opts.sortOrder != "asc" and opts.sortOrder != "desc":
         gb_log(COLOURS["Error"], "Invalid sort value, options are 'asc' or 'desc'")
         return False
 
+    if opts.shouldWork and opts.queuePath is None:
+        gb_log(COLOURS["Error"], "--worker needs the --queue to work on")
+        return False
+
+    if opts.queuePath is not None and not (opts.shouldWork or opts.download_subscriptions):
+        gb_log(COLOURS["Error"], "--queue is used with --download_subscriptions or --worker")
+        return False
+
+    if opts.batchFile is not None and opts.shouldFilter:
+        gb_log(COLOURS["Error"], "--batch takes its filters from the file, not --filter")
+        return False
+
+    if opts.rate <= 0:
+        gb_log(COLOURS["Error"], "Invalid rate, must be more than 0 requests per second")
+        return False
+
     return True
 
 def stream_video(url):
-    " Steam the video at url "
+    """ Play the video at url with mplayer
+        Returns False if mplayer couldn't be run """
     if url is None:
         gb_log(COLOURS["Error"], "Invalid URL, perhaps try another quality level?")
-        return
+        return True
 
     try:
-        call(["mplayer", url + "?api_key=" + get_api_key()])
+        from subprocess import call
+        call(["mplayer", url])
     except OSError:
         gb_log(COLOURS["Error"],
                "Something has gone wrong whilst trying to stream, is mplayer installed?")
+        return False
+    return True
+
+
+class StopFeed(Exception):
+    " Raised from a feed's progress updates to stop its download "
 
-def download_video(url, filename):
-    " Download the video at url to filename"
+
+class StreamFeed:
+    """ A video downloaded to disk so it can be played while it arrives. The feed
+        is given to the download as its progress, so it knows how much of the
+        file can be read. Until it starts playing only the first
+        STREAM_PREFETCH_SIZE bytes are fetched """
+    def __init__(self, api_key, url, filename, video_id=None, keep=False, settings=None):
+        self.api_key = api_key
+        self.url = url
+        self.request_url = url + "?api_key=" + api_key
+        self.filename = filename
+        self.video_id = video_id
+        self.keep = keep
+        self.settings = settings
+        self.condition = threading.Condition()
+        self.available = 0
+        self.size = None
+        self.playing = False
+        self.cancelled = False
+        self.done = False
+        self.failed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        partial = PartialDownload(self.filename)
+        if partial.load() and len(partial.segments) > 1:
+            # Only a download made in order from the start can be played while it arrives
+            partial.discard_state()
+
+        completed = False
+        while True:
+            try:
+                if self.keep:
+                    completed = download_to_library(self.api_key, self.url, self.filename, self, 1,
+                                                    self.video_id, self.settings)
+                else:
+                    completed = download_video(self.api_key, self.url, self.filename, self, 1,
+                                               self.settings) is not False
+                break
+            except StopFeed:
+                with self.condition:
+                    while not self.playing and not self.cancelled:
+                        self.condition.wait()
+                    if self.cancelled:
+                        break
+
+        with self.condition:
+            if completed and os.path.isfile(self.filename):
+                self.size = self.available = os.path.getsize(self.filename)
+            else:
+                self.failed = True
+            self.done = True
+            self.condition.notify_all()
+
+    def update(self, filename, downloaded, size):
+        " Called by the download as data arrives "
+        with self.condition:
+            self.available = downloaded
+            self.size = size if size >= 0 else None
+            self.condition.notify_all()
+            if self.cancelled or (not self.playing and downloaded >= STREAM_PREFETCH_SIZE):
+                raise StopFeed()
+
+    def play(self):
+        " Let the download carry on past the prefetched data "
+        with self.condition:
+            self.playing = True
+            self.condition.notify_all()
+
+    def cancel(self):
+        " Stop downloading, the feed will fail if it hadn't finished "
+        with self.condition:
+            self.cancelled = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def wait_for(self, position):
+        """ Wait until the byte at position has been fetched
+            Returns False if it isn't going to be """
+        with self.condition:
+            deadline = time.monotonic() + STREAM_WAIT
+            while self.available <= position and not self.done:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return self.available > position
+
+    def open(self):
+        " Open whichever file the video is being written to "
+        if not self.done:
+            try:
+                return open(self.filename + ".part", "rb")
+            except FileNotFoundError:
+                pass
+        return open(self.filename, "rb")
+
+
+class StreamProxyHandler:
+    """ Serves a feed to the player from what has been downloaded so far,
+        answering range requests so the player can seek. It's combined with
+        http.server's BaseHTTPRequestHandler when the proxy starts """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def serve(self, send_body):
+        feed = self.server.feeds.get(self.path)
+        if feed is None:
+            self.send_error(404)
+            return
+        if not feed.wait_for(0):
+            self.send_error(502)
+            return
+
+        size = feed.size
+        start = 0
+        end = None if size is None else size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match is not None and size is not None:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{0}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if not feed.done and start > feed.available + STREAM_DIRECT_DISTANCE:
+                self.relay(feed, start, end, send_body)
+                return
+        else:
+            match = None
+
+        self.send_response(200 if match is None else 206)
+        import mimetypes
+        self.send_header("Content-Type", mimetypes.guess_type(feed.filename)[0] or
+                         "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        if end is None:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(end - start + 1))
+            if match is not None:
+                self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, size))
+        self.end_headers()
+        if not send_body:
+            return
+
+        position = start
+        try:
+            with feed.open() as video_file:
+                while end is None or position <= end:
+                    if not feed.wait_for(position):
+                        break
+                    length = feed.available - position
+                    if end is not None:
+                        length = min(length, end - position + 1)
+                    video_file.seek(position)
+                    chunk = video_file.read(min(length, DOWNLOAD_CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    position += len(chunk)
+        except OSError:
+            # The player closed the connection, usually to seek
+            pass
+        if end is not None and position <= end:
+            self.close_connection = True
+
+    def relay(self, feed, start, end, send_body):
+        " Pass a request for data far past what has been downloaded straight to the server "
+        headers = {"Range": "bytes={0}-{1}".format(start, "" if end is None else end)}
+        try:
+            response = SESSION.request(feed.request_url, headers)
+        except URLError:
+            self.send_error(502)
+            return
+
+        with response:
+            self.send_response(response.status)
+            for header in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges"):
+                if response.headers.get(header) is not None:
+                    self.send_header(header, response.headers.get(header))
+            self.end_headers()
+            if not send_body:
+                return
+            try:
+                for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    self.wfile.write(chunk)
+            except OSError:
+                self.close_connection = True
+
+
+class StreamProxy:
+    " Serves the feeds being played on 127.0.0.1, from a background thread "
+    def __init__(self):
+        from http.server import BaseHTTPRequestHandler
+        from http.server import ThreadingHTTPServer
+        handler = type("StreamProxyRequestHandler", (StreamProxyHandler, BaseHTTPRequestHandler), {})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.server.feeds = self.feeds = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add(self, feed):
+        " Returns the url the feed can be played from "
+        path = "/{0}/{1}".format(len(self.feeds) + 1, quote(os.path.basename(feed.filename)))
+        self.feeds[path] = feed
+        return "http://127.0.0.1:{0}{1}".format(self.server.server_address[1], path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StreamPlaylist:
+    """ Plays videos one after another through a StreamProxy. Each video starts
+        downloading while the one before it plays, so playback starts straight
+        away. With keep the downloads are finished and kept in the output folder
+        as if they had been made with --download, otherwise they are thrown away
+        after playing """
+    def __init__(self, api_key, output_folder=None, keep=False, settings=None):
+        self.api_key = api_key
+        self.output_folder = output_folder
+        self.keep = keep
+        self.settings = settings
+        self.proxy = None
+        self.folder = None
+        self.queued = None
+        self.feeds = []
+        self.stopped = False
+
+    def add(self, url, name, video_id=None):
+        " Queue a video and play the one queued before it "
+        if self.stopped:
+            return
+        if self.proxy is None:
+            self.proxy = StreamProxy()
+            if self.keep:
+                self.folder = self.output_folder
+            else:
+                import tempfile
+                self.folder = tempfile.mkdtemp(prefix="giant_bomb_cli_")
+
+        feed = StreamFeed(self.api_key, url, get_video_filename(url, name, self.folder), video_id,
+                          self.keep, self.settings).start()
+        self.feeds.append(feed)
+        queued, self.queued = self.queued, (feed, self.proxy.add(feed))
+        if queued is not None:
+            self.play(*queued)
+
+    def play(self, feed, proxy_url):
+        feed.play()
+        if not stream_video(proxy_url):
+            self.stopped = True
+        if not self.keep:
+            feed.cancel()
+
+    def finish(self):
+        """ Play the last video queued and wait for the downloads being kept
+            Returns the number of videos that failed to download """
+        if self.queued is not None and not self.stopped:
+            queued, self.queued = self.queued, None
+            self.play(*queued)
+        return self.close()
+
+    def close(self):
+        failed = 0
+        for feed in self.feeds:
+            if not self.keep or self.stopped:
+                feed.cancel()
+            elif not feed.done:
+                gb_log(COLOURS["Desc"], "Waiting for " + feed.filename + " to finish downloading")
+                feed.play()
+                feed.thread.join()
+            if feed.failed and not feed.cancelled:
+                failed += 1
+        if self.proxy is not None:
+            self.proxy.close()
+            self.proxy = None
+        if self.folder is not None and not self.keep:
+            shutil.rmtree(self.folder, ignore_errors=True)
+        self.feeds = []
+        return failed
+
+class LibraryIndex:
+    """ Every video downloaded, with its expected size, checksum and the video it
+        came from, kept in ~/.giant_bomb_cli/library.db. It lets a download be
+        skipped when a verified copy is already in place, and lets copies of the
+        same video in different folders share storage through hardlinks """
+    def __init__(self, path=LIBRARY_LOCATION):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = None
+
+    def connect(self):
+        " Open the database the first time it's needed, must be called with the lock held "
+        if self.connection is None:
+            import sqlite3
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            with self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                                        "path TEXT PRIMARY KEY, video_key TEXT NOT NULL, "
+                                        "video_id INTEGER, size INTEGER NOT NULL, "
+                                        "sha256 TEXT NOT NULL, mtime_ns INTEGER NOT NULL)")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS files_by_video_key "
+                                        "ON files (video_key)")
+                self.connection.execute("CREATE INDEX IF NOT EXISTS files_by_sha256 "
+                                        "ON files (sha256)")
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    @staticmethod
+    def get_video_key(url):
+        " The same video has the same url whichever subscription or search it came from "
+        parts = urlsplit(url)
+        return parts.netloc.lower() + parts.path
+
+    @staticmethod
+    def checksum(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as video_file:
+            for block in iter(lambda: video_file.read(LIBRARY_HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get_entry(self, path):
+        with self.lock:
+            return self.connect().execute("SELECT video_key, video_id, size, sha256, mtime_ns "
+                                          "FROM files WHERE path = ?", (path,)).fetchone()
+
+    def is_verified(self, path):
+        """ True if path is a complete copy of what we downloaded there. Files whose
+            size and modification time are unchanged are trusted, otherwise the
+            checksum is compared """
+        entry = self.get_entry(path)
+        if entry is None:
+            return False
+        video_key, video_id, size, sha256, mtime_ns = entry
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.remove(path)
+            return False
+
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime_ns == mtime_ns:
+            return True
+        if self.checksum(path) != sha256:
+            return False
+        self.add(path, video_key, video_id, size, sha256)
+        return True
+
+    def find_copy(self, url, exclude_path):
+        " A verified copy of the video at url somewhere other than exclude_path "
+        with self.lock:
+            rows = self.connect().execute("SELECT path FROM files WHERE video_key = ? AND path != ?",
+                                          (self.get_video_key(url), exclude_path)).fetchall()
+        for (path,) in rows:
+            if self.is_verified(path):
+                return path
+        return None
+
+    def find_identical(self, path, sha256, size):
+        " A verified copy of the same content stored in a different file "
+        with self.lock:
+            rows = self.connect().execute("SELECT path FROM files WHERE sha256 = ? AND size = ? "
+                                          "AND path != ?", (sha256, size, path)).fetchall()
+        for (other_path,) in rows:
+            try:
+                if os.path.samefile(path, other_path):
+                    continue
+            except OSError:
+                continue
+            if self.is_verified(other_path):
+                return other_path
+        return None
+
+    def add(self, path, video_key, video_id, size, sha256):
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self.lock, self.connect():
+            self.connection.execute("INSERT OR REPLACE INTO files (path, video_key, video_id, size, "
+                                    "sha256, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (path, video_key, video_id, size, sha256, mtime_ns))
+
+    def remove(self, path):
+        with self.lock, self.connect():
+            self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def record_download(self, path, url, video_id, expected_size):
+        """ Add a freshly downloaded file, replacing it with a hardlink if another
+            file in the library has exactly the same content """
+        size = os.path.getsize(path)
+        if expected_size is not None and size != expected_size:
+            gb_log(COLOURS["Error"], "{0} is {1} bytes but the server said {2}".format(path, size,
+                                                                                      expected_size))
+            return False
+        sha256 = self.checksum(path)
+        identical = self.find_identical(path, sha256, size)
+        if identical is not None and link_file(identical, path):
+            gb_log(COLOURS["Desc"], "Linked " + path + " to identical " + identical)
+        self.add(path, self.get_video_key(url), video_id, size, sha256)
+        return True
+
+    def copy_from(self, source, path, url, video_id):
+        " Put a verified copy of a video at path, as a hardlink if possible "
+        if not link_file(source, path):
+            shutil.copyfile(source, path + ".part")
+            os.replace(path + ".part", path)
+        entry = self.get_entry(source)
+        self.add(path, self.get_video_key(url), video_id, entry[2], entry[3])
+
+
+LIBRARY = LibraryIndex()
+
+def link_file(source, path):
+    " Atomically replace path with a hardlink to source, returns False if they can't be linked "
+    temp_path = path + ".link"
+    try:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        os.link(source, temp_path)
+        os.replace(temp_path, path)
+    except OSError:
+        return False
+    return True
+
+def convert_bytes_to_string(size):
+    " Convert a size in bytes to a nicely formatted string "
+    if size is None:
+        return "unknown size"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024.0
+    return ("{0:.0f} {1}" if unit == "B" else "{0:.1f} {1}").format(size, unit)
+
+
+class QualityProbe:
+    """ Finds out which qualities of a video the server has, and how big each one
+        is, with HEAD requests made concurrently. Results are remembered in
+        ~/.giant_bomb_cli/probes.json for PROBE_TTL so videos aren't probed again
+        on every run """
+    def __init__(self, path=PROBE_LOCATION):
+        self.path = path
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.refresh = False
+        # normalised url -> [available, size, time probed]
+        self.results = None
+        self.dirty = False
+        self.executor = None
+
+    def load(self):
+        " Read the results of earlier runs the first time they're needed, must be called with the lock held "
+        if self.results is None:
+            self.results = {}
+            if self.enabled and not self.refresh:
+                try:
+                    with open(self.path) as probe_file:
+                        self.results = json.load(probe_file)
+                except (OSError, ValueError):
+                    pass
+        return self.results
+
+    def save(self):
+        """ Write out the results that are still fresh. The probing threads are
+            left running, other clients may still be using them """
+        with self.lock:
+            if not self.enabled or not self.dirty:
+                return
+            now = time.time()
+            results = dict((url, result) for url, result in self.results.items()
+                           if now - result[2] < PROBE_TTL)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path + ".tmp", "w") as probe_file:
+                    json.dump(results, probe_file)
+                os.replace(self.path + ".tmp", self.path)
+                self.dirty = False
+            except OSError as error:
+                gb_log(COLOURS["Error"], "Couldn't save probe results: " + str(error))
+
+    def check(self, url, api_key):
+        """ Whether url exists and its size in bytes. Available is None if the server
+            couldn't be asked, size is None if the server won't say """
+        key = ResponseCache.normalise_url(url)
+        with self.lock:
+            result = self.load().get(key)
+        if result is not None and time.time() - result[2] < PROBE_TTL:
+            return result[0], result[1]
+
+        separator = "&" if "?" in url else "?"
+        try:
+            with SESSION.request(url + separator + "api_key=" + api_key, method="HEAD") as response:
+                length = response.headers.get("Content-Length")
+            available = True
+            size = int(length) if length is not None and length.isdigit() else None
+        except HTTPError as error:
+            if error.code not in (401, 403, 404, 410):
+                return None, None
+            available = False
+            size = None
+        except URLError:
+            return None, None
+
+        with self.lock:
+            self.load()[key] = [available, size, time.time()]
+            self.dirty = True
+        return available, size
+
+    def start(self, urls, api_key):
+        """ Start probing each quality's url at once
+            Returns a dict of quality -> future of (available, size) """
+        with self.lock:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(PROBE_JOBS)
+            executor = self.executor
+        return dict((quality, executor.submit(self.check, url, api_key))
+                    for quality, url in urls.items() if url)
+
+    @staticmethod
+    def choose(probes, quality):
+        """ Pick the quality to use from the results of start, trying the one asked
+            for first, then lower qualities and then higher ones. A quality that
+            couldn't be probed is only used if none are known to be available
+            Returns (quality, size), or (None, None) if there's nothing to use """
+        if quality in QUALITY_ORDER:
+            index = QUALITY_ORDER.index(quality)
+            candidates = QUALITY_ORDER[index:] + list(reversed(QUALITY_ORDER[:index]))
+        else:
+            candidates = QUALITY_ORDER
+
+        results = dict((name, future.result()) for name, future in probes.items())
+        for name in candidates:
+            if name in results and results[name][0]:
+                return name, results[name][1]
+        for name in candidates:
+            if name in results and results[name][0] is None:
+                return name, None
+        return None, None
+
+
+PROBE = QualityProbe()
+
+def get_video_urls(video):
+    " The url of each quality of a video from the api "
+    return dict((quality, video.get(quality + "_url")) for quality in QUALITY_ORDER)
+
+def get_episode_urls(episode):
+    " The url of each quality of a subscribed episode "
+    return {"hd": episode.hd_url, "high": episode.high_url, "low": episode.low_url}
+
+
+class RestartDownload(Exception):
+    " Raised when a partial download can't be resumed and must start again "
+
+
+class DownloadSettings:
+    """ How downloads are written to disk. With preallocate the whole file is
+        reserved as soon as its size is known, so a full disk is found before
+        anything is fetched. fsync is one of FSYNC_POLICIES: never leaves it to
+        the operating system, end syncs each file before it's moved into place
+        and checkpoint also syncs the data every time a download's state is saved """
+    def __init__(self, preallocate=False, fsync="end"):
+        self.preallocate = preallocate
+        self.fsync = fsync
+
+
+# Used by downloads that aren't given settings of their own
+DOWNLOADS = DownloadSettings()
+
+def allocate_file(part_file, size, preallocate=False):
+    """ Give part_file its full size, reserving the space on disk when preallocate
+        is set. Raises OSError if there isn't room for it """
+    if preallocate and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(part_file.fileno(), 0, size)
+            return
+        except OSError as exception:
+            if exception.errno == errno.ENOSPC:
+                raise
+            # Not supported by this filesystem, a sparse file will have to do
+    part_file.truncate(size)
+
+def sync_directory(path):
+    " Make sure a file moved into the directory path survives a crash "
+    if os.name != "posix":
+        return
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class PartialDownload:
+    """ The on-disk state of a download in progress. Data is written to
+        filename.part and the byte ranges of each segment still to be fetched are
+        recorded in filename.part.json, so an interrupted download can resume """
+    def __init__(self, filename, settings=None):
+        self.filename = filename
+        self.settings = settings or DOWNLOADS
+        self.part_filename = filename + ".part"
+        self.state_filename = self.part_filename + ".json"
+        self.lock = threading.Lock()
+        self.size = None
+        self.validator = None
+        # each segment is [start, end, bytes done], end is None until the size is known
+        self.segments = []
+
+    def load(self):
+        " Load the state of a previous attempt, returns False if there isn't one "
+        if not os.path.isfile(self.part_filename):
+            return False
+        try:
+            with open(self.state_filename) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return False
+
+        self.size = state["size"]
+        self.validator = state["validator"]
+        self.segments = state["segments"]
+        return True
+
+    def save(self):
+        " Atomically write out the segment state "
+        with self.lock:
+            state = dict(size=self.size, validator=self.validator, segments=self.segments)
+            with open(self.state_filename + ".tmp", "w") as state_file:
+                json.dump(state, state_file)
+                if self.settings.fsync == "checkpoint":
+                    state_file.flush()
+                    os.fsync(state_file.fileno())
+            os.replace(self.state_filename + ".tmp", self.state_filename)
+
+    def reset(self, size=None, validator=None, segment_count=1):
+        " Throw away any previous data and split the download into segments "
+        self.size = size
+        self.validator = validator
+        if size is None or segment_count <= 1:
+            self.segments = [[0, None if size is None else size - 1, 0]]
+        else:
+            segment_size = -(-size // segment_count)
+            self.segments = [[start, min(start + segment_size, size) - 1, 0]
+                             for start in range(0, size, segment_size)]
+
+        with open(self.part_filename, "wb") as part_file:
+            if size is not None:
+                try:
+                    allocate_file(part_file, size, self.settings.preallocate)
+                except OSError:
+                    part_file.close()
+                    os.remove(self.part_filename)
+                    raise
+        self.save()
+
+    def allocate(self):
+        " Reserve the rest of the file once a download learns its size "
+        if self.settings.preallocate and self.size is not None:
+            with open(self.part_filename, "r+b") as part_file:
+                allocate_file(part_file, self.size, True)
+
+    def checkpoint(self, part_file):
+        " Save the state of the download, once the data it describes is on disk if asked to "
+        if self.settings.fsync == "checkpoint":
+            os.fsync(part_file.fileno())
+        self.save()
+
+    def downloaded(self):
+        return sum(segment[2] for segment in self.segments)
+
+    def finish(self):
+        " Verify the part file is complete and move it into place "
+        if self.size is None or os.path.getsize(self.part_filename) != self.size \
+                or self.downloaded() != self.size:
+            raise RestartDownload("downloaded size does not match the server's")
+        if self.settings.fsync != "never":
+            with open(self.part_filename, "rb") as part_file:
+                os.fsync(part_file.fileno())
+        os.replace(self.part_filename, self.filename)
+        if self.settings.fsync != "never":
+            sync_directory(os.path.dirname(self.filename))
+        self.discard_state()
+
+    def discard_state(self):
+        try:
+            os.remove(self.state_filename)
+        except OSError:
+            pass
+
+
+def get_validator(response):
+    " The header value used to check a resumed download is still the same file "
+    return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+def get_total_size(response):
+    " Work out the full size of the file from a (possibly partial) response "
+    content_range = response.headers.get("Content-Range")
+    if content_range is not None and "/" in content_range:
+        total = content_range.split("/")[-1]
+        return int(total) if total.isdigit() else None
+
+    content_length = response.headers.get("Content-Length")
+    if response.status == 200 and content_length is not None:
+        return int(content_length)
+    return None
+
+def begin_download(request_url, partial, segments):
+    """ Start a fresh download, if more than one segment is requested the server
+        is probed to see if it supports range requests and the file is large enough """
+    if segments > 1:
+        with SESSION.request(request_url, {"Range": "bytes=0-0"}) as response:
+            if response.status == 206:
+                response.read()
+            # Otherwise the server is sending the whole file, closing the response
+            # drops the connection rather than reading it
+        size = get_total_size(response)
+        if response.status == 206 and size is not None and size >= SEGMENT_MIN_SIZE:
+            partial.reset(size, get_validator(response), segments)
+            return
+
+    partial.reset()
+
+def fetch_segment(request_url, partial, segment, progress):
+    " Fetch the remaining bytes of a segment into the part file "
+    start, end, done = segment
+    offset = start + done
+    if end is not None and offset > end:
+        return
+
+    headers = {}
+    if offset > 0 or len(partial.segments) > 1:
+        headers["Range"] = "bytes={0}-{1}".format(offset, "" if end is None else end)
+        if partial.validator is not None:
+            headers["If-Range"] = partial.validator
+
+    try:
+        response = SESSION.request(request_url, headers)
+    except HTTPError as exception:
+        if exception.code == 416 and end is None:
+            # We already have everything the server does
+            partial.size = offset
+            segment[1] = offset - 1
+            return
+        raise
+
+    with response:
+        if "Range" in headers and response.status != 206:
+            # The server ignored the range or the file has changed since
+            raise RestartDownload("server did not honour range request")
+
+        if end is None:
+            partial.size = get_total_size(response)
+            if partial.size is not None:
+                segment[1] = partial.size - 1
+                partial.allocate()
+        if partial.validator is None:
+            partial.validator = get_validator(response)
+        partial.save()
+
+        buffer = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+        unsaved = 0
+        # Unbuffered, the data goes from our buffer straight to the file
+        with open(partial.part_filename, "r+b", buffering=0) as part_file:
+            part_file.seek(offset)
+            try:
+                while True:
+                    length = response.readinto(buffer)
+                    if not length:
+                        break
+                    written = 0
+                    while written < length:
+                        written += part_file.write(buffer[written:length])
+                    METRICS.record_transfer(length)
+                    segment[2] += length
+                    unsaved += length
+                    if unsaved >= STATE_SAVE_INTERVAL:
+                        partial.checkpoint(part_file)
+                        unsaved = 0
+                    if progress is not None:
+                        progress.update(partial.filename, partial.downloaded(), partial.size or -1)
+            finally:
+                partial.checkpoint(part_file)
+
+    if segment[1] is None:
+        # No length was given, the end of the stream is the end of the file
+        segment[1] = start + segment[2] - 1
+        partial.size = segment[1] + 1
+    elif start + segment[2] <= segment[1]:
+        raise ConnectionError("connection closed before the segment was complete")
+
+def fetch_segments(request_url, partial, progress):
+    " Fetch every incomplete segment, in parallel when there are several "
+    if len(partial.segments) == 1:
+        fetch_segment(request_url, partial, partial.segments[0], progress)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=len(partial.segments)) as executor:
+        futures = [executor.submit(fetch_segment, request_url, partial, segment, progress)
+                   for segment in partial.segments]
+    for future in futures:
+        future.result()
+
+def download_video(api_key, url, filename, progress=None, segments=1, settings=None):
+    """ Download the video at url to filename, resuming any earlier attempt, with
+        settings, DOWNLOADS by default, deciding how it's written to disk
+        Returns the size of the completed download, or False if it failed """
     if url is None:
         gb_log(COLOURS["Error"], "Invalid URL, perhaps try another quality level?")
-        return
+        return False
 
     gb_log(COLOURS["Title"], "Downloading " + url + " to " + filename)
-    try:
-        urlretrieve(url + "?api_key=" + get_api_key(), filename, reporthook=dlProgress)
-    except OSError:
-        gb_log(COLOURS["Error"],
-               "Something has gone wrong whilst trying to download?")
-               
-def dlProgress(count, blockSize, totalSize):
-    percent = int(count*blockSize*100/totalSize)
-    sys.stdout.write("%2d%%" % percent)
-    sys.stdout.write("\b\b\b")
-    sys.stdout.flush()
-    
-def output_response(response, args):
-    " Prints details of videos found "
+    request_url = url + "?api_key=" + api_key
+    partial = PartialDownload(filename, settings)
+    start = time.monotonic()
+
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            if partial.load():
+                gb_log(COLOURS["Desc"], "Resuming " + filename + " from " +
+                       str(partial.downloaded()) + " bytes")
+            else:
+                begin_download(request_url, partial, segments)
+            fetch_segments(request_url, partial, progress)
+            partial.finish()
+            METRICS.record_download(time.monotonic() - start, True)
+            return partial.size
+        except RestartDownload as exception:
+            gb_log(COLOURS["Error"], "Restarting download of " + filename + ": " + str(exception))
+            partial.discard_state()
+        except HTTPError as exception:
+            if 400 <= exception.code < 500 and exception.code not in (408, 416):
+                # Asking again won't change the answer
+                gb_log(COLOURS["Error"], "Download of " + filename + " refused (" +
+                       str(exception) + ")")
+                if partial.downloaded() == 0:
+                    # Don't leave an empty part file behind
+                    partial.discard_state()
+                    try:
+                        os.remove(partial.part_filename)
+                    except OSError:
+                        pass
+                break
+            gb_log(COLOURS["Error"], "Download of " + filename + " interrupted (" +
+                   str(exception) + "), retrying")
+            time.sleep(2 ** attempt)
+        except OSError as exception:
+            if exception.errno == errno.ENOSPC:
+                # Trying again won't make any more room
+                gb_log(COLOURS["Error"], "Not enough disk space to download " + filename)
+                break
+            gb_log(COLOURS["Error"], "Download of " + filename + " interrupted (" +
+                   str(exception) + "), retrying")
+            time.sleep(2 ** attempt)
+
+    gb_log(COLOURS["Error"],
+           "Something has gone wrong whilst trying to download " + filename + "?")
+    METRICS.record_download(time.monotonic() - start, False)
+    return False
 
-    for video in response["results"]:
-        name = video["name"]
-        desc = video["deck"]
-        time_in_secs = video["length_seconds"]
-        video_id = video["id"]
-        video_type = video["video_type"]
-        url = video[args.quality + "_url"]
 
+class DownloadProgress:
+    """ Tracks the progress of every running download and renders it, along with
+        the overall progress, on a single status line """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_files = 0
+        self.finished_files = 0
+        self.active = {}
+        self.last_render = 0.0
+
+    def add_file(self):
+        with self.lock:
+            self.total_files += 1
+
+    def update(self, filename, done, total):
+        " Record how far a download has got, redrawn at most every PROGRESS_INTERVAL "
+        with self.lock:
+            self.active[filename] = (done, total)
+            if time.monotonic() - self.last_render >= PROGRESS_INTERVAL:
+                self.render()
+
+    def finish(self, filename):
+        " Count a file as done, filename is None if it never got one "
+        with self.lock:
+            self.active.pop(filename, None)
+            self.finished_files += 1
+            self.render()
+
+    def render(self):
+        " Draw the status line, must be called with the lock held "
+        self.last_render = time.monotonic()
+        if not CONSOLE.interactive:
+            return
+        status = "[{0}/{1}]".format(self.finished_files, self.total_files)
+        for filename, (done, total) in list(self.active.items())[:3]:
+            name = os.path.basename(filename)[:24]
+            if total > 0:
+                status += " {0} {1:d}%".format(name, min(int(done * 100 / total), 100))
+            else:
+                status += " {0} {1:.1f}MB".format(name, done / 1048576.0)
+        if len(self.active) > 3:
+            status += " (+{0} more)".format(len(self.active) - 3)
+        CONSOLE.set_status(status)
+
+
+class DownloadScheduler:
+    """ Runs downloads concurrently on a bounded pool of worker threads
+        and keeps track of which ones succeeded """
+    def __init__(self, api_key, jobs=1, segments=1, settings=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.api_key = api_key
+        self.executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+        self.segments = segments
+        self.settings = settings
+        self.progress = DownloadProgress()
+        self.lock = threading.Lock()
+        self.succeeded = []
+        self.failed = []
+
+    def submit(self, url, name, output_folder, on_success=None, video_id=None):
+        """ Queue a video for download, on_success is called from the worker
+            thread once the file has been written """
+        self.progress.add_file()
+        return self.executor.submit(self.run, url, name, output_folder, on_success, video_id)
+
+    def run(self, url, name, output_folder, on_success, video_id):
+        success = False
+        try:
+            success = prepare_and_download(self.api_key, url, name, output_folder, self.progress,
+                                           self.segments, video_id, self.settings)
+            if success and on_success is not None:
+                on_success()
+        except Exception as exception:
+            gb_log(COLOURS["Error"], "Download of " + name + " failed: " + str(exception))
+            success = False
+
+        with self.lock:
+            if success:
+                self.succeeded.append(name)
+            else:
+                self.failed.append(name)
+        return success
+
+    def wait(self):
+        """ Block until every queued download has finished and print a summary
+            Returns the number of failed downloads """
+        try:
+            self.executor.shutdown(wait=True)
+        except KeyboardInterrupt:
+            gb_log(COLOURS["Error"], "Interrupted, cancelling queued downloads")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            CONSOLE.clear_status()
+
+        self.print_summary()
+        return len(self.failed)
+
+    def print_summary(self):
+        if self.progress.total_files == 0:
+            return
+        gb_log(COLOURS["Title"], "Downloaded {0} of {1} videos".format(len(self.succeeded),
+                                                                      self.progress.total_files))
+        for name in self.failed:
+            gb_log(COLOURS["Error"], "\tFailed: " + name)
+
+class TextWriter:
+    " Prints videos as coloured text for people to read "
+    def write(self, video):
         gb_log(COLOURS["Title"],
-               u"{0} ({1}) [{2}] ID:{3}".format(name, video_type,
-                                                convert_seconds_to_string(time_in_secs),
-                                                video_id))
-        gb_log(COLOURS["Desc"], "\t" + desc)
+               u"{0} ({1}) [{2}] ID:{3}".format(video["name"], video["video_type"],
+                                                convert_seconds_to_string(video["length_seconds"]),
+                                                video["id"]))
+        gb_log(COLOURS["Desc"], "\t" + (video["deck"] or ""))
+        if "sizes" in video:
+            sizes = ["{0} {1}".format(quality, "missing" if video["sizes"][quality] is False
+                                      else convert_bytes_to_string(video["sizes"][quality]))
+                     for quality in QUALITY_ORDER]
+            gb_log(COLOURS["Desc"], "\tSizes: " + ", ".join(sizes))
+
+
+class NDJSONWriter:
+    " Writes each video as a line of JSON "
+    def write(self, video):
+        sys.stdout.write(json.dumps(video) + "\n")
+        sys.stdout.flush()
+
+
+class CSVWriter:
+    " Writes each video as a CSV row, after a header row "
+    def __init__(self, fields=CSV_FIELDS):
+        import csv
+        self.writer = csv.DictWriter(sys.stdout, fields, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, video):
+        row = dict(video)
+        for field, value in row.items():
+            if isinstance(value, (dict, list)):
+                row[field] = json.dumps(value)
+        self.writer.writerow(row)
+        sys.stdout.flush()
+
+
+OUTPUT_FORMATS = {"text": TextWriter,
+                  "ndjson": NDJSONWriter,
+                  "csv": CSVWriter, }
+
+def choose_video_url(urls, probes, quality, name):
+    """ The url of the best available quality of a video, up to quality, from the
+        results of PROBE.start. Returns (url, quality, size), url is None if no
+        quality of the video is available """
+    chosen, size = PROBE.choose(probes, quality)
+    if chosen is None:
+        gb_log(COLOURS["Error"], "No quality of " + name + " is available")
+        return None, None, None
+    if quality != "best" and chosen != quality:
+        gb_log(COLOURS["Desc"], name + " isn't available in " + quality + " quality, using " + chosen)
+    return urls[chosen], chosen, size
+
+def probe_ahead(videos, api_key, window=PROBE_JOBS):
+    " Yields each video with its probes, which are started window videos ahead "
+    pending = deque()
+    for video in videos:
+        pending.append((video, PROBE.start(get_video_urls(video), api_key)))
+        if len(pending) > window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+def output_response(videos, args, scheduler):
+    """ Writes out the details of each video found as soon as it arrives,
+        streaming or queueing its download if asked to. Returns the number of
+        videos streamed that failed to download. When the video files are
+        needed the qualities of the next few videos are probed while earlier
+        ones are written out """
+    if args.outputFormat == "csv":
+        writer = CSVWriter(CSV_FIELDS + ["quality", "size"] if args.shouldProbe else CSV_FIELDS)
+    else:
+        writer = OUTPUT_FORMATS[args.outputFormat]()
+
+    if args.shouldProbe or args.shouldDownload or args.shouldStream:
+        videos = probe_ahead(videos, scheduler.api_key)
+    else:
+        videos = ((video, None) for video in videos)
 
-        if args.shouldStream:
-            stream_video(url)
+    playlist = None
+    if args.shouldStream:
+        playlist = StreamPlaylist(scheduler.api_key, args.outputFolder, args.keepStreams,
+                                  scheduler.settings)
+    try:
+        output_videos(videos, args, writer, scheduler, playlist)
+        if playlist is not None:
+            return playlist.finish()
+    finally:
+        if playlist is not None:
+            playlist.close()
+    return 0
+
+def output_videos(videos, args, writer, scheduler, playlist):
+    " Writes out each video and its probe results, and plays or downloads it "
+    count = 0
+    total_size = 0
+    unknown_sizes = 0
+    unavailable = 0
+    for video, probes in videos:
+        count += 1
+        url = video.get(args.quality + "_url")
+        if probes is not None:
+            url, quality, size = choose_video_url(get_video_urls(video), probes,
+                                                  args.quality, video["name"])
+            if url is None:
+                unavailable += 1
+            elif size is None:
+                unknown_sizes += 1
+            else:
+                total_size += size
+            if args.shouldProbe:
+                # false for a quality that isn't available, null if its size is unknown
+                sizes = dict((name, False) for name in QUALITY_ORDER)
+                for name, future in probes.items():
+                    available, sizes[name] = future.result()
+                    if available is False:
+                        sizes[name] = False
+                video = dict(video, quality=quality, size=size, sizes=sizes)
+        writer.write(video)
+
+        if url is None:
+            continue
+        if playlist is not None:
+            playlist.add(url, video["name"], video["id"])
         elif args.shouldDownload:
-            prepare_and_download(url,name,args.outputFolder)
+            scheduler.submit(url, video["name"], args.outputFolder, video_id=video["id"])
 
-    if len(response["results"]) == 0:
+    if count == 0:
         gb_log(COLOURS["Desc"], "No video results")
+    elif args.shouldProbe:
+        summary = "Total size of {0} videos: {1}".format(count - unavailable - unknown_sizes,
+                                                         convert_bytes_to_string(total_size))
+        if unknown_sizes > 0:
+            summary += ", plus {0} of unknown size".format(unknown_sizes)
+        if unavailable > 0:
+            summary += ", {0} not available".format(unavailable)
+        gb_log(COLOURS["Title"], summary)
+
+
+def prepare_and_download(api_key, url, name, outputFolder, progress=None, segments=1,
+                         video_id=None, settings=None):
+    """ Builds the filename for the video and downloads it, then tells progress the
+        file is finished. Returns True if the download completed """
+    filename = None
+    try:
+        if url is None:
+            gb_log(COLOURS["Error"], "Invalid URL for " + name + ", perhaps try another quality level?")
+            return False
 
+        filename = get_video_filename(url, name, outputFolder)
+        return download_to_library(api_key, url, filename, progress, segments, video_id, settings)
+    finally:
+        if progress is not None:
+            # Under the same name the download reports its progress with
+            progress.finish(filename)
 
-def prepare_and_download(url, name, outputFolder):
-    # Construct filename
+def get_video_filename(url, name, outputFolder):
+    " Builds the filename a video is saved to, creating the output folder if needed "
     filename = name.replace(" ", "_")
     filename = filename.replace("/", "-")
     filename = filename.replace(":", "")
@@ -422,14 +3188,44 @@ def prepare_and_download(url, name, outputFolder):
 
     if outputFolder != None:
         if not os.path.exists(outputFolder):
-            os.makedirs(outputFolder)
+            os.makedirs(outputFolder, exist_ok=True)
         filename = outputFolder + "/" + filename
 
-    download_video(url, filename)
+    return filename
+
+def download_to_library(api_key, url, filename, progress=None, segments=1, video_id=None,
+                        settings=None):
+    """ Download a video unless a verified copy is already at filename, or can be
+        linked from elsewhere in the library, and record the result in the library
+        Returns True if a complete copy is at filename afterwards """
+    path = os.path.abspath(filename)
+
+    if LIBRARY.is_verified(path):
+        gb_log(COLOURS["Desc"], "Already downloaded " + filename + ", skipping")
+        return True
+
+    if os.path.isfile(path) and LIBRARY.get_entry(path) is None:
+        # Downloaded before the library existed, keep it if it's the size the server says
+        expected_size = PROBE.check(url, api_key)[1]
+        if expected_size is not None and os.path.getsize(path) == expected_size:
+            LIBRARY.record_download(path, url, video_id, expected_size)
+            gb_log(COLOURS["Desc"], "Already downloaded " + filename + ", skipping")
+            return True
+
+    copy = LIBRARY.find_copy(url, path)
+    if copy is not None:
+        LIBRARY.copy_from(copy, path, url, video_id)
+        gb_log(COLOURS["Desc"], "Linked " + filename + " to existing copy " + copy)
+        return True
 
-def get_api_key():
-    " Get the users api key, either from the cache or via user input"
+    expected_size = download_video(api_key, url, filename, progress, segments, settings)
+    if expected_size is False:
+        return False
+    return LIBRARY.record_download(path, url, video_id, expected_size)
 
+def get_api_key(prompt=False):
+    """ Get the users api key from the config file. If there isn't one it's asked
+        for and saved when prompt is set, otherwise APIError is raised """
     if os.path.exists(CONFIG_LOCATION) is False:
         os.makedirs(CONFIG_LOCATION)
 
@@ -437,16 +3233,231 @@ def get_api_key():
 
     config_json = json.loads("{}")
     if os.path.isfile(config_file_path):
-        config_json = json.load(open(config_file_path, "r"))
-    else:
+        with open(config_file_path, "r") as config_file:
+            config_json = json.load(config_file)
+    elif prompt:
         user_api = input('Please enter your API key: ')
         config_json["API_KEY"] = user_api.strip()
-        json.dump(config_json, open(config_file_path, "w"))
+        with open(config_file_path, "w") as config_file:
+            json.dump(config_json, config_file)
+    else:
+        raise APIError("no api key in " + config_file_path + ", pass one as api_key")
 
     return config_json["API_KEY"]
 
+async def run_in_thread(function, *args, **kwargs):
+    " Run a blocking function in a worker thread so it can be awaited "
+    import asyncio
+    return await asyncio.to_thread(function, *args, **kwargs)
+
+async def iterate_in_thread(iterator):
+    " Iterate over a blocking iterator from asyncio, fetching each item in a worker thread "
+    done = object()
+    while True:
+        item = await run_in_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+class VideoQuery:
+    """ A search for videos. Its fields are named after the command line's
+        arguments, so the parsed arguments can be used as a query too """
+    def __init__(self, limit=25, offset=0, sort="desc", name=None, video_id=None,
+                 video_type=None, show_id=None, start_date=None, end_date=None, local=False):
+        self.limit = limit
+        self.offest = offset
+        self.sortOrder = sort
+        self.filterName = name
+        self.contentID = None if video_id is None else str(video_id)
+        self.videoType = None if video_type is None else str(video_type)
+        self.showID = None if show_id is None else str(show_id)
+        self.startDate = start_date
+        self.endDate = end_date
+        self.shouldFilter = any(value is not None for value in (name, video_id, video_type, show_id,
+                                                                start_date, end_date))
+        self.local = local
+        self.debugMode = False
+
+
+class GiantBombClient:
+    """ The Giant Bomb API for use from other programs, the command line is a thin
+        wrapper around it. The api key is read from the config file unless one is
+        given, and APIError is raised if there's neither. Each client keeps its key
+        and download settings to itself, but clients share the module's connection
+        pool, response cache and rate limits, so timeout, cache, refresh, rate and
+        hourly_budget change them for every client and are left alone unless
+        given. Every method has an asyncio version ending in _async that runs it
+        in a worker thread
+
+            with GiantBombClient() as client:
+                for video in client.videos(limit=10, video_type=3):
+                    client.download(video, output_folder="quick_looks")
+    """
+    def __init__(self, api_key=None, timeout=None, cache=None, refresh=None, rate=None,
+                 hourly_budget=None, preallocate=False, fsync="end"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("fsync must be one of " + ", ".join(FSYNC_POLICIES))
+        self.api_key = api_key if api_key is not None else get_api_key()
+        self.settings = DownloadSettings(preallocate, fsync)
+
+        if timeout is not None:
+            SESSION.timeout = timeout
+        if cache is not None:
+            CACHE.enabled = cache
+            PROBE.enabled = cache
+        if refresh is not None:
+            CACHE.refresh = refresh
+            PROBE.refresh = refresh
+        if rate is not None:
+            SCHEDULER.rate = rate
+        if hourly_budget is not None:
+            SCHEDULER.hourly_budget = hourly_budget
+        SCHEDULER.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Save the request quota and probe results. The connection pool, probing
+            threads and library are shared with any other clients, so they're left
+            open and go away with the process """
+        SCHEDULER.save()
+        PROBE.save()
+
+    def video_types(self):
+        """ The list of video types
+            Raises APIError if it can't be retrieved """
+        return get_video_types(self.api_key)
+
+    def video_shows(self):
+        """ The list of video shows
+            Raises APIError if it can't be retrieved """
+        return get_video_shows(self.api_key)
+
+    def videos(self, limit=25, offset=0, sort="desc", name=None, video_id=None, video_type=None,
+               show_id=None, start_date=None, end_date=None, local=False):
+        """ Generates the videos matching the filters, dates are YYYY-MM-DD. With local
+            they come from the catalog made by sync_catalog instead of the API
+            Raises APIError if a page of results can't be retrieved """
+        return self.search(VideoQuery(limit, offset, sort, name, video_id, video_type, show_id,
+                                      start_date, end_date, local))
+
+    def search(self, query):
+        " Generates the videos matching a VideoQuery or the command line's arguments "
+        if query.local:
+            return iterate_local_videos(query)
+        return iterate_videos(query, self.api_key)
+
+    def search_all(self, queries, jobs=BATCH_JOBS):
+        """ Generates the videos matching any of several VideoQuery, running jobs of them
+            at once, with each video only given once
+            Raises APIError, after the other searches, if any of them failed """
+        return iterate_batch(queries, self.search, jobs)
+
+    def choose_quality(self, video, quality="best"):
+        """ Probe which qualities of a video exist and choose the best up to quality
+            Returns (url, quality, size), url is None if no quality is available """
+        urls = get_video_urls(video)
+        return choose_video_url(urls, PROBE.start(urls, self.api_key), quality, video["name"])
+
+    def download(self, video, quality="high", output_folder=None, segments=1):
+        """ Download a video in the best quality available up to quality
+            Returns the path it was saved to, or None if it failed """
+        url = self.choose_quality(video, quality)[0]
+        if url is None:
+            return None
+        filename = get_video_filename(url, video["name"], output_folder)
+        if not download_to_library(self.api_key, url, filename, None, segments, video["id"],
+                                   self.settings):
+            return None
+        return filename
+
+    def download_all(self, videos, quality="high", output_folder=None, jobs=4, segments=1):
+        """ Download videos jobs at a time, showing their progress
+            Returns the number that couldn't be downloaded """
+        scheduler = DownloadScheduler(self.api_key, jobs, segments, self.settings)
+        unavailable = 0
+        for video, probes in probe_ahead(videos, self.api_key):
+            url = choose_video_url(get_video_urls(video), probes, quality, video["name"])[0]
+            if url is None:
+                unavailable += 1
+                continue
+            scheduler.submit(url, video["name"], output_folder, video_id=video["id"])
+        return scheduler.wait() + unavailable
+
+    def subscribe(self, show_id, output_folder, skip_old=True):
+        " Subscribe to a show, returns 1 if it failed "
+        return subscribe(self.api_key, str(show_id), output_folder, skip_old)
+
+    def download_subscriptions(self, quality="high", jobs=4, segments=1, queue=None):
+        """ Download the new episodes of every subscribed show, or put them in the work
+            queue at the path queue for run_worker. Returns the number that failed """
+        return download_subscriptions(self.api_key, quality, jobs, segments, queue, self.settings)
+
+    def watch_subscriptions(self, quality="high", jobs=4, segments=1):
+        """ Download new episodes of the subscribed shows as they come out, until
+            interrupted. Returns the number that failed """
+        return watch_subscriptions(self.api_key, quality, jobs, segments, self.settings)
+
+    def run_worker(self, queue, jobs=4, segments=1):
+        """ Download from the work queue at the path queue until it's empty
+            Returns the number that failed """
+        return run_queue_worker(self.api_key, queue, jobs, segments, self.settings)
+
+    def sync_catalog(self):
+        " Bring the local catalog up to date, returns 1 if it failed "
+        return sync_catalog(self.api_key)
+
+    async def video_types_async(self):
+        return await run_in_thread(self.video_types)
+
+    async def video_shows_async(self):
+        return await run_in_thread(self.video_shows)
+
+    async def videos_async(self, *args, **kwargs):
+        " An async iterator over the videos matching the filters "
+        async for video in iterate_in_thread(self.videos(*args, **kwargs)):
+            yield video
+
+    async def search_async(self, query):
+        async for video in iterate_in_thread(self.search(query)):
+            yield video
+
+    async def search_all_async(self, queries, jobs=BATCH_JOBS):
+        async for video in iterate_in_thread(self.search_all(queries, jobs)):
+            yield video
+
+    async def choose_quality_async(self, video, quality="best"):
+        return await run_in_thread(self.choose_quality, video, quality)
+
+    async def download_async(self, video, quality="high", output_folder=None, segments=1):
+        return await run_in_thread(self.download, video, quality, output_folder, segments)
+
+    async def download_all_async(self, videos, quality="high", output_folder=None, jobs=4, segments=1):
+        return await run_in_thread(self.download_all, list(videos), quality, output_folder, jobs, segments)
+
+    async def subscribe_async(self, show_id, output_folder, skip_old=True):
+        return await run_in_thread(self.subscribe, show_id, output_folder, skip_old)
+
+    async def download_subscriptions_async(self, quality="high", jobs=4, segments=1, queue=None):
+        return await run_in_thread(self.download_subscriptions, quality, jobs, segments, queue)
+
+    async def watch_subscriptions_async(self, quality="high", jobs=4, segments=1):
+        return await run_in_thread(self.watch_subscriptions, quality, jobs, segments)
+
+    async def run_worker_async(self, queue, jobs=4, segments=1):
+        return await run_in_thread(self.run_worker, queue, jobs, segments)
+
+    async def sync_catalog_async(self):
+        return await run_in_thread(self.sync_catalog)
+
 def main():
     " Main entry point "
+    import argparse
     parser = argparse.ArgumentParser(description='Giant Bomb Command Line Interface v1.0.0')
 
     parser.add_argument('-l', '--limit', dest="limit", action="store", type=int,
@@ -460,7 +3471,12 @@ def main():
     parser.add_argument('--quality', dest="quality", action="store",
                         default="high",
                         help="the quality of the video, used when streaming or downloading" +
-                        " (low, high, hd) defaults to %(default)s")
+                        " (low, high, hd, best) defaults to %(default)s. If a video isn't" +
+                        " available in that quality the next best one is used")
+
+    parser.add_argument('--probe', dest="shouldProbe", action="store_true",
+                        help="check which qualities of each video exist and how big they are," +
+                        " and the total size of the videos found")
 
     parser.add_argument('--download', dest="shouldDownload", action="store_true",
                         help="will attempt to download all videos matching filters", default=False)
@@ -469,9 +3485,36 @@ def main():
                         help="will attempt to stream videos matching filters via mplayer",
                         default=False)
 
+    parser.add_argument('--keep', dest="keepStreams", action="store_true",
+                        help="keep the videos streamed in the output folder, as if they'd" +
+                        " been downloaded")
+
     parser.add_argument('--output', dest="outputFolder", action="store",
                         help="the folder to output downloaded content to")
 
+    parser.add_argument('--format', dest="outputFormat", action="store", default="text",
+                        choices=sorted(OUTPUT_FORMATS),
+                        help="how to write out the videos found (text, ndjson, csv)," +
+                        " defaults to %(default)s")
+
+    parser.add_argument('-j', '--jobs', dest="jobs", action="store", type=int,
+                        default=4, metavar="<x>",
+                        help="the number of videos to download at once, defaults to %(default)s")
+
+    parser.add_argument('--segments', dest="segments", action="store", type=int,
+                        default=1, metavar="<x>",
+                        help="split large videos into this many parts downloaded in parallel," +
+                        " defaults to %(default)s")
+
+    parser.add_argument('--preallocate', dest="preallocate", action="store_true",
+                        help="reserve the disk space for each video before downloading it," +
+                        " so a full disk is noticed straight away", default=False)
+
+    parser.add_argument('--fsync', dest="fsync", action="store", default="end",
+                        choices=FSYNC_POLICIES,
+                        help="when downloads are flushed to disk: never, at the end of each" +
+                        " video, or also at every resume checkpoint. Defaults to %(default)s")
+
     parser.add_argument('--dump_video_types', dest="shouldDumpIDs", action="store_true",
                         help="will dump all known ids for video types,", default=False)
 
@@ -481,6 +3524,11 @@ def main():
     parser.add_argument('--sort', dest="sortOrder", action="store", default="desc",
                         help="orders the videos by their id (asc/desc) defaults to desc")
 
+    parser.add_argument('--batch', dest="batchFile", action="store", metavar="<file>",
+                        help="run every search in this file, one JSON object of filters per" +
+                        " line, at the same time and output or download the videos they find" +
+                        " (- reads them from stdin)")
+
     parser.add_argument('--dump_video_shows', dest="shouldDumpShowIDs", action="store_true",
                         help="will dump all known ids for video shows,", default=False)
 
@@ -490,6 +3538,26 @@ def main():
     parser.add_argument('--download_subscriptions', dest="download_subscriptions", action="store_true",
                             help="will download un-downloaded or un-skiped episodes of subscriptions", default=False)
 
+    parser.add_argument('--watch', dest="shouldWatch", action="store_true",
+                        help="keep running, checking each subscribed show for new episodes as" +
+                        " often as it publishes and downloading them straight away", default=False)
+
+    parser.add_argument('--queue', dest="queuePath", action="store", metavar="<path>",
+                        help="with --download_subscriptions, add the episodes to this work" +
+                        " queue instead of downloading them, so --worker processes on any" +
+                        " machine that can see it can share the downloads")
+
+    parser.add_argument('--worker', dest="shouldWork", action="store_true",
+                        help="download the episodes in the --queue until there are none left",
+                        default=False)
+
+    parser.add_argument('--sync-catalog', dest="syncCatalog", action="store_true",
+                        help="copy the details of every video into the local catalog", default=False)
+
+    parser.add_argument('--local', dest="local", action="store_true",
+                        help="answer the search from the local catalog instead of the api" +
+                        " (see --sync-catalog)", default=False)
+
     parser.add_argument('--dont_skip_old', dest="dont_skip_old", action="store_false", 
                         help="when adding new subscriptions, specifies whether old episodes should be skipped")
     
@@ -510,53 +3578,118 @@ def main():
     filter_opts.add_argument('--video_show_Id', dest="showID", action="store",
                              help="id of the video show (see --dump_video_shows)")
 
+    filter_opts.add_argument('--start_date', dest="startDate", action="store", metavar="YYYY-MM-DD",
+                             help="only videos published on or after this date")
+
+    filter_opts.add_argument('--end_date', dest="endDate", action="store", metavar="YYYY-MM-DD",
+                             help="only videos published on or before this date")
+
+    parser.add_argument('--timeout', dest="timeout", action="store", type=float,
+                        default=HTTP_TIMEOUT, metavar="<seconds>",
+                        help="how long to wait on the server before giving up, defaults to %(default)s")
+
+    parser.add_argument('--no-cache', dest="noCache", action="store_true",
+                        help="don't read or write the api response cache", default=False)
+
+    parser.add_argument('--refresh', dest="refresh", action="store_true",
+                        help="check with the server before using any cached api response",
+                        default=False)
+
+    parser.add_argument('--rate', dest="rate", action="store", type=float,
+                        default=API_RATE, metavar="<x>",
+                        help="the most api requests to make per second, defaults to %(default)s")
+
+    parser.add_argument('--hourly_budget', dest="hourlyBudget", action="store", type=int,
+                        default=API_HOURLY_BUDGET, metavar="<x>",
+                        help="the most requests to make to each api resource per hour," +
+                        " 0 for no limit, defaults to %(default)s")
+
+    parser.add_argument('--metrics-file', dest="metricsFile", action="store", metavar="<path>",
+                        help="write request and download metrics to this file at the end of the run")
+
+    parser.add_argument('--metrics-format', dest="metricsFormat", action="store",
+                        choices=["json", "prometheus"],
+                        help="format of the metrics file, defaults to prometheus for .prom files" +
+                        " and json otherwise")
+
     # Debug options
     degbug_options = parser.add_argument_group("Debug Options")
     degbug_options.add_argument('--debug', dest="debugMode", action="store_true",
-                                help="logs server requests and json responses", default=False)
+                                help="logs server requests, json responses and connection reuse",
+                                default=False)
 
     args = parser.parse_args()
 
     if validate_args(args) is False:
         return 1
 
-    # Check for API key
-    api_key = get_api_key()
+    if args.outputFormat != "text":
+        # Keep stdout for the records themselves
+        CONSOLE.set_stream(sys.stderr)
 
+    client = GiantBombClient(api_key=get_api_key(prompt=True), timeout=args.timeout,
+                             cache=not args.noCache, refresh=args.refresh, rate=args.rate,
+                             hourly_budget=args.hourlyBudget, preallocate=args.preallocate,
+                             fsync=args.fsync)
+    try:
+        return run_command(args, client)
+    finally:
+        if args.debugMode:
+            gb_log(COLOURS["Debug"], SESSION.stats())
+            gb_log(COLOURS["Debug"], "API requests retried: {0}".format(SCHEDULER.retries))
+        client.close()
+        if args.metricsFile is not None:
+            METRICS.write(args.metricsFile, args.metricsFormat)
+
+def run_command(args, client):
+    " Carry out the command the user asked for "
     if args.shouldDumpIDs:
-        dump_video_types(api_key)
-        return 0
+        return dump_video_types(client.api_key)
 
     if args.shouldDumpShowIDs:
-        dump_video_shows(api_key)
-        return 0
+        return dump_video_shows(client.api_key)
 
     if args.subscribe:
-        subscribe(api_key,args)
-        return 0 
-
-    if args.download_subscriptions:
-        download_subscriptions(api_key,args)
-        return 0 
-
-
-    # Create the url and make the request
-    request_url = create_request_url(args, api_key) + create_filter_string_from_args(args)
-    json_obj = json.loads("{}")
-
-    if args.debugMode:
-        gb_log(COLOURS["Debug"], "Requesting url: " + request_url)
+        return client.subscribe(args.subscribe, args.outputFolder, args.dont_skip_old)
+
+    if args.shouldWatch:
+        return 1 if client.watch_subscriptions(args.quality, args.jobs, args.segments) > 0 else 0
+
+    if args.download_subscriptions or args.shouldWork:
+        failed = 0
+        if args.download_subscriptions:
+            failed += client.download_subscriptions(args.quality, args.jobs, args.segments,
+                                                    args.queuePath)
+        if args.shouldWork:
+            failed += client.run_worker(args.queuePath, args.jobs, args.segments)
+        return 1 if failed > 0 else 0
+
+    if args.syncCatalog:
+        return client.sync_catalog()
+
+
+    queries = None
+    if args.batchFile is not None:
+        try:
+            # The search options on the command line apply to every line without its own
+            queries = read_batch_file(args.batchFile, dict(limit=args.limit, offset=args.offest,
+                                                           sort=args.sortOrder, local=args.local))
+        except (OSError, ValueError) as exception:
+            gb_log(COLOURS["Error"], "Couldn't read the batch file: " + str(exception))
+            return 1
+
+    # Page through the results, outputting and downloading them as they arrive
+    scheduler = DownloadScheduler(client.api_key, args.jobs, args.segments, client.settings)
+    failed = False
+    try:
+        videos = client.search(args) if queries is None else client.search_all(queries)
+        failed = output_response(videos, args, scheduler) > 0
+    except APIError as exception:
+        gb_log(COLOURS["Error"], "Failed to get response from server: " + str(exception))
+        failed = True
 
-    if retrieve_json_from_url(request_url, json_obj) is False:
-        gb_log(COLOURS["Error"], "Failed to get response from server")
+    if scheduler.wait() > 0 or failed:
         return 1
 
-    if args.debugMode:
-        gb_log(COLOURS["Debug"],
-               "Received {0} of {1} possible results".format(json_obj["number_of_page_results"],
-                                                             json_obj["number_of_total_results"]))
-        gb_log(COLOURS["Debug"], json.dumps(json_obj, sort_keys=True, indent=4))
-
-    output_response(json_obj, args)
-
-main()
+if __name__ == "__main__":
+    sys.exit(main())